@@ -0,0 +1,63 @@
+import random
+import tracemalloc
+from dataclasses import make_dataclass, fields, asdict
+
+from blacksheep.settings.json import json_settings
+
+from benchmarks.rectangles import make_matrix
+from service.catalog import CatalogIndex, Maf, read_catalog
+from service.pipeline import calculate_rects
+from service.state import Rect
+
+# dict-backed dataclasses and asdict serialization, as before slotted types
+LegacyMaf = make_dataclass('LegacyMaf', [(field.name, field.type) for field in fields(Maf)], frozen=True)
+LegacyRect = make_dataclass('LegacyRect', [(field.name, field.type) for field in fields(Rect)])
+
+
+def as_legacy(rects: list[Rect]) -> list:
+    mafs = {}
+    legacy = []
+    for rect in rects:
+        maf = None
+        if rect.maf:
+            maf = mafs.get(rect.maf.key)
+            if maf is None:
+                maf = mafs[rect.maf.key] = LegacyMaf(**rect.maf.as_dict())
+        legacy.append(LegacyRect(**{**rect.as_dict(), 'maf': maf}))
+    return legacy
+
+
+def measure(function) -> tuple[int, int, int, object]:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    result = function()
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    retained = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    return retained, blocks, peak, result
+
+
+def main():
+    catalog, _ = read_catalog()
+    index = CatalogIndex(catalog)
+    for size in (100, 300):
+        matrix = make_matrix(size, size, seed=size)
+        random.seed(size)
+        rects = calculate_rects(matrix.copy(), 5_000_000, index, ['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ'])
+        slotted, slotted_blocks, _, _ = measure(lambda: [
+            Rect(**{field.name: getattr(rect, field.name) for field in fields(Rect)}) for rect in rects
+        ])
+        legacy, legacy_blocks, _, legacy_rects = measure(lambda: as_legacy(rects))
+        _, _, slotted_peak, _ = measure(lambda: json_settings.dumps([rect.as_dict() for rect in rects]))
+        _, _, legacy_peak, _ = measure(lambda: json_settings.dumps([asdict(rect) for rect in legacy_rects]))
+        print(f'{size}x{size} {len(rects)} rects: '
+              f'retained {legacy / 1024:.0f} KiB ({legacy_blocks} blocks) -> {slotted / 1024:.0f} KiB ({slotted_blocks} blocks), '
+              f'serialization peak {legacy_peak / 1024:.0f} KiB -> {slotted_peak / 1024:.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
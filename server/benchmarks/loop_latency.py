@@ -0,0 +1,88 @@
+import asyncio
+import statistics
+import time
+
+from blacksheep.contents import JSONContent
+from blacksheep.testing import TestClient
+
+from benchmarks.rectangles import make_matrix
+from service.app import app, pool
+
+
+async def inline_run(function, *args):
+    # handlers before offloading: work runs right on the event loop
+    return function(*args)
+
+
+async def measure_lag(stop: asyncio.Event, lags: list[float], interval=0.001):
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - t - interval)
+
+
+async def measure_state(client: TestClient, stop: asyncio.Event, latencies: list[float]):
+    while not stop.is_set():
+        t = time.perf_counter()
+        await client.get('/api/bench-state/state')
+        latencies.append(time.perf_counter() - t)
+        await asyncio.sleep(0.005)
+
+
+async def run_load(client: TestClient, requests: int, size: int, seed: int) -> dict:
+    stop = asyncio.Event()
+    lags = []
+    latencies = []
+    lag_task = asyncio.create_task(measure_lag(stop, lags))
+    state_task = asyncio.create_task(measure_state(client, stop, latencies))
+    bodies = [
+        {
+            'name': 'Осенний бульвар 10к2',
+            'matrix': make_matrix(size, size, seed=seed + i).tolist(),
+            'budget': 2_000_000,
+            'providers': ['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ'],
+        }
+        for i in range(requests)
+    ]
+    t = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post(f'/api/bench-{i}/calculation', content=JSONContent(body))
+        for i, body in enumerate(bodies)
+    ])
+    elapsed = time.perf_counter() - t
+    stop.set()
+    await asyncio.gather(lag_task, state_task)
+    lags = sorted(lags)
+    return {
+        'elapsed': elapsed,
+        'ok': sum(1 for response in responses if response.status == 200),
+        'busy': sum(1 for response in responses if response.status == 503),
+        'lag_p99': lags[int(len(lags) * 0.99)] if lags else 0.0,
+        'lag_max': lags[-1] if lags else 0.0,
+        'state_median': statistics.median(latencies) if latencies else 0.0,
+        'state_max': max(latencies) if latencies else 0.0,
+    }
+
+
+def report(name: str, result: dict):
+    print(
+        f'{name}: {result["ok"]} ok, {result["busy"]} busy in {result["elapsed"]:.2f} s, '
+        f'loop lag p99 {result["lag_p99"] * 1000:.1f} ms max {result["lag_max"] * 1000:.1f} ms, '
+        f'/state median {result["state_median"] * 1000:.1f} ms max {result["state_max"] * 1000:.1f} ms'
+    )
+
+
+async def main(requests=16, size=100):
+    await app.start()
+    client = TestClient(app)
+    # measure latency, not rejections
+    pool.queue_depth = requests
+    pool.run = inline_run
+    report('inline', await run_load(client, requests, size, seed=0))
+    del pool.run
+    report(f'pool ({pool.workers} workers)', await run_load(client, requests, size, seed=requests))
+    await app.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
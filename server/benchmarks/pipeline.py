@@ -0,0 +1,220 @@
+import argparse
+import gc
+import hashlib
+import json
+import multiprocessing
+import os.path
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.allocations import measure
+from benchmarks.rectangles import make_matrix
+from service.artifacts import build_artifacts
+from service.batch import as_matrix
+from service.catalog import CatalogIndex, read_catalog
+from service.pipeline import generate_tiles, plan_rects, assign_plan, calculate_rects
+from service.state import base_path, PatternAtlas, decompose_rectangles
+
+baseline_path = os.path.dirname(__file__) + '/baseline.json'
+
+providers = ['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ']
+ages = {'sport': True, 'child': True, 'relax': True}
+budget_per_meter = 1000.0
+
+# size classes of NOTES.md and beyond, width x height in meters
+sites = [
+    ('small 24x14', 24, 14, 'rectangle'),
+    ('small 23x18', 23, 18, 'trapezoid'),
+    ('medium 40x20', 40, 20, 'rectangle'),
+    ('medium 30x20', 30, 20, 'triangle'),
+    ('medium 42x27', 42, 27, 'rectangle'),
+    ('large 51x28', 51, 28, 'trapezoid'),
+    ('large 50x40', 50, 40, 'rectangle'),
+    ('large 70x20', 70, 20, 'triangle'),
+    ('huge 150x120', 150, 120, 'trapezoid'),
+]
+
+
+def make_area(w: int, h: int, shape: str, seed: int) -> list[list[float]]:
+    # local metric polygon with jittered corners, like projected registry sites
+    rnd = random.Random(seed)
+
+    def jitter(x: float, y: float) -> list[float]:
+        return [min(w, max(0.0, x + rnd.uniform(-0.4, 0.4))), min(h, max(0.0, y + rnd.uniform(-0.4, 0.4)))]
+
+    if shape == 'triangle':
+        corners = [(0, 0), (w, 0), (0, h)]
+    elif shape == 'trapezoid':
+        corners = [(0, 0), (w, 0), (w * 0.8, h), (w * 0.1, h)]
+    else:
+        corners = [(0, 0), (w, 0), (w, h), (0, h)]
+    return [jitter(x, y) for x, y in corners]
+
+
+def digest(value) -> str:
+    return hashlib.blake2b(repr(value).encode(), digest_size=8).hexdigest()
+
+
+def get_stages(patterns: PatternAtlas, index: CatalogIndex, area: list[list[float]], seed: int) -> list:
+    # every stage is run on fresh inputs prepared by previous ones, randomness is seeded per run
+    site = build_artifacts(patterns, area)
+    budget = int(site.area.area * budget_per_meter)
+    tiles = generate_tiles(patterns, site, ages, offset=(0, 0))
+    matrix = as_matrix(tiles)
+    plans = plan_rects(matrix.copy())
+
+    def decompose():
+        work = matrix.copy()
+        return [decompose_rectangles(work, mark) for mark in (1, 2, 3)]
+
+    def assign():
+        random.seed(seed)
+        rects = assign_plan(plans, budget, index, providers)
+        return [rect.as_dict() for rect in rects]
+
+    def end_to_end():
+        random.seed(seed)
+        site = build_artifacts(patterns, area)
+        matrix = as_matrix(generate_tiles(patterns, site, ages))
+        rects = calculate_rects(matrix, budget, index, providers)
+        return [rect.as_dict() for rect in rects]
+
+    return [
+        ('rasterize', lambda: build_artifacts(patterns, area).coverage.tolist()),
+        ('generate', lambda: generate_tiles(patterns, site, ages, offset=(0, 0))),
+        ('decompose', decompose),
+        ('plan', lambda: [(plan.kind, plan.share, [rect.as_dict() for rect in plan.rectangles]) for plan in plan_rects(matrix.copy())]),
+        ('assign', assign),
+        ('end-to-end', end_to_end),
+    ]
+
+
+def calibrate(repeat: int) -> float:
+    # fixed python and numpy workload, stage times are compared relative to it across runs and machines
+    matrix = make_matrix(100, 100, seed=0)
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        sorted(str(value) for value in range(20_000))
+        np.cumsum(matrix, axis=0).argmax()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def time_function(function, repeat: int) -> float:
+    # warm up caches, best of repeats without gc pauses is least affected by noise, as in timeit
+    function()
+    times = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            t = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - t)
+    finally:
+        gc.enable()
+    return min(times)
+
+
+def run(repeat: int) -> dict:
+    patterns = PatternAtlas.load(base_path + '/data/patterns.png')
+    catalog, _ = read_catalog()
+    index = CatalogIndex(catalog)
+    calibrations = []
+    stages = {}
+    for seed, (name, w, h, shape) in enumerate(sites):
+        area = make_area(w, h, shape, seed)
+        for stage, function in get_stages(patterns, index, area, seed):
+            # machine speed drifts during run, it is sampled between stages
+            calibrations.append(calibrate(5))
+            elapsed = time_function(function, repeat)
+            retained, blocks, peak, result = measure(function)
+            stages[f'{name} {stage}'] = {
+                'time': elapsed,
+                'retained': retained,
+                'blocks': blocks,
+                'peak': peak,
+                'result': digest(result),
+            }
+    return {'calibrations': calibrations, 'stages': stages}
+
+
+def run_processes(runs: int, repeat: int) -> dict:
+    # speed differs between processes on shared machines, best time of every stage is kept
+    calibrations = []
+    stages = {}
+    context = multiprocessing.get_context('spawn')
+    for _ in range(runs):
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results = executor.submit(run, repeat).result()
+        calibrations += results['calibrations']
+        for key, current in results['stages'].items():
+            if key not in stages or current['time'] < stages[key]['time']:
+                stages[key] = current
+    return {'calibration': statistics.median(calibrations), 'stages': stages}
+
+
+def compare(results: dict, baseline: dict, time_tolerance: float, memory_tolerance: float) -> list[str]:
+    # times are scaled to machine speed of baseline run,
+    # small absolute changes are noise, both thresholds have to be crossed
+    regressions = []
+    scale = baseline['calibration'] / results['calibration']
+    for key, current in results['stages'].items():
+        previous = baseline['stages'].get(key)
+        if previous is None:
+            continue
+        elapsed = current['time'] * scale
+        if current['result'] != previous['result']:
+            regressions.append(f'{key}: result changed')
+        if elapsed > previous['time'] * (1 + time_tolerance) and elapsed - previous['time'] > 0.0002:
+            regressions.append(f'{key}: time {previous["time"] * 1000:.2f} -> {elapsed * 1000:.2f} ms scaled')
+        if current['peak'] > previous['peak'] * (1 + memory_tolerance) and current['peak'] - previous['peak'] > 64 * 1024:
+            regressions.append(f'{key}: peak {previous["peak"] / 1024:.0f} -> {current["peak"] / 1024:.0f} KiB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generation and calculation pipeline benchmark on synthetic sites')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=3, help='fresh processes to run suite in')
+    parser.add_argument('--baseline', default=baseline_path)
+    # timings of shared machines drift by half even after calibration, results are compared exactly
+    parser.add_argument('--time-tolerance', type=float, default=1.0)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    parser.add_argument('--update', action='store_true', help='store results as new baseline')
+    args = parser.parse_args()
+
+    results = run_processes(args.runs, args.repeat)
+    baseline = {'calibration': results['calibration'], 'stages': {}}
+    if os.path.exists(args.baseline) and not args.update:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    scale = baseline['calibration'] / results['calibration']
+    print(f'calibration {results["calibration"] * 1000:.2f} ms, times scaled by {scale:.2f} to baseline machine speed')
+    for key, current in results['stages'].items():
+        previous = baseline['stages'].get(key)
+        change = f'{(current["time"] * scale / previous["time"] - 1) * 100:+6.1f}%' if previous else '    new'
+        print(f'{key:<28} {current["time"] * 1000:8.2f} ms {change}  '
+              f'peak {current["peak"] / 1024:7.0f} KiB  retained {current["retained"] / 1024:6.0f} KiB '
+              f'({current["blocks"]} blocks)')
+
+    if args.update:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f'baseline saved to {args.baseline}')
+        return
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if regressions:
+        print(f'{len(regressions)} regressions against {args.baseline}:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import random
+import time
+
+import numpy as np
+
+from service.state import find_max_rectangles, decompose_rectangles
+
+
+def make_matrix(rows: int, cols: int, seed: int) -> np.ndarray:
+    # zones of sport/child/relax tiles clipped by triangle site, like generated patterns
+    rnd = random.Random(seed)
+    matrix = np.zeros((rows, cols), dtype=np.int8)
+    for _ in range(rows * cols // 20):
+        w = rnd.randint(2, 12)
+        h = rnd.randint(2, 12)
+        x = rnd.randint(0, cols - 1)
+        y = rnd.randint(0, rows - 1)
+        matrix[y:y + h, x:x + w] = rnd.randint(1, 3)
+    ys, xs = np.mgrid[0:rows, 0:cols]
+    matrix[xs * rows > (rows - ys) * cols] = 0
+    return matrix
+
+
+def decompose_full_scan(matrix: np.ndarray, mark: int) -> list:
+    rectangles = []
+    while found := find_max_rectangles(matrix, mark):
+        sx, sy, w, h = found
+        matrix[sy:sy + h, sx:sx + w] = 0
+        rectangles.append(found)
+    return rectangles
+
+
+def measure(decompose, matrix: np.ndarray) -> tuple[float, list]:
+    matrix = matrix.copy()
+    rectangles = []
+    t = time.perf_counter()
+    for mark in (1, 2, 3):
+        rectangles += decompose(matrix, mark)
+    return time.perf_counter() - t, rectangles
+
+
+def main():
+    for size in (100, 300):
+        matrix = make_matrix(size, size, seed=size)
+        full_time, full_rects = measure(decompose_full_scan, matrix)
+        incremental_time, incremental_rects = measure(decompose_rectangles, matrix)
+        assert full_rects == incremental_rects
+        print(
+            f'{size}x{size}: {len(full_rects)} rects, '
+            f'full scan {full_time * 1000:.1f} ms, '
+            f'incremental {incremental_time * 1000:.1f} ms, '
+            f'speedup x{full_time / incremental_time:.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
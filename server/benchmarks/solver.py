@@ -0,0 +1,53 @@
+import random
+import statistics
+import time
+
+from benchmarks.rectangles import make_matrix
+from service.catalog import CatalogIndex, read_catalog
+from service.pipeline import plan_rects, assign_plan
+
+providers = ['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ']
+
+sites = [
+    ('small 24x14', 14, 24, 600_000),
+    ('medium 40x20', 20, 40, 1_500_000),
+    ('large 70x20', 20, 70, 2_700_000),
+    ('huge 100x100', 100, 100, 10_000_000),
+]
+
+
+def evaluate(rects, budget: int) -> tuple[float, float]:
+    spent = sum(rect.maf.cost for rect in rects if rect.maf)
+    area = sum(rect.area for rect in rects)
+    covered = sum(rect.maf.tiles[0] * rect.maf.tiles[1] for rect in rects if rect.maf)
+    return spent / budget, covered / area
+
+
+def run(plans, index, budget, solver, timeout, seeds) -> tuple[float, float, float]:
+    spent, covered, times = [], [], []
+    for seed in seeds:
+        random.seed(seed)
+        t = time.perf_counter()
+        rects = assign_plan(plans, budget, index, providers, solver, timeout)
+        times.append(time.perf_counter() - t)
+        budget_use, coverage = evaluate(rects, budget)
+        spent.append(budget_use)
+        covered.append(coverage)
+    return statistics.mean(spent), statistics.mean(covered), statistics.median(times)
+
+
+def main():
+    catalog, _ = read_catalog()
+    index = CatalogIndex(catalog)
+    for name, rows, cols, budget in sites:
+        plans = plan_rects(make_matrix(rows, cols, seed=rows * cols))
+        print(name)
+        results = [('greedy', run(plans, index, budget, 'greedy', 0.0, range(10)))]
+        for timeout in (0.001, 0.01, 0.1, 1.0):
+            results.append((f'optimal {timeout * 1000:.0f} ms', run(plans, index, budget, 'optimal', timeout, range(3))))
+        for label, (spent, covered, elapsed) in results:
+            print(f'  {label:<16} budget used {spent * 100:5.1f}%, tiles covered {covered * 100:5.1f}%, {elapsed * 1000:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import time
+
+from blacksheep import Application
+from blacksheep.server.routing import Router
+from blacksheep.server.files import get_default_extensions
+from blacksheep.testing import TestClient
+
+from service.app import app, assets
+from service.assets import brotli
+
+
+def make_plain_app() -> Application:
+    # static files as served before asset routes
+    plain = Application(router=Router())
+    extensions = get_default_extensions()
+    extensions.add('.glb')
+    plain.serve_files('web', index_document='index.html', fallback_document='index.html', extensions=extensions)
+    return plain
+
+
+async def visit(client: TestClient, paths: list[str], headers: dict, etags: dict) -> tuple[int, int, int]:
+    # one pass over all paths, returns requests, body bytes out and not modified responses
+    sent = 0
+    not_modified = 0
+    for path in paths:
+        request_headers = dict(headers)
+        if path in etags:
+            request_headers['if-none-match'] = etags[path]
+        response = await client.get(path, headers=request_headers)
+        body = await response.read() or b''
+        sent += len(body)
+        if response.status == 304:
+            not_modified += 1
+        elif response.status not in (200, 206):
+            raise RuntimeError(f'{path}: {response.status}')
+        etag = response.headers.get_first(b'ETag')
+        if etag:
+            etags.setdefault(path, etag.decode())
+    return len(paths), sent, not_modified
+
+
+async def run_scenario(client: TestClient, paths: list[str], headers: dict, passes: int, revalidate: bool) -> tuple[float, float, int, int, int]:
+    # first pass touches mapped pages and fills etags of client, it is reported as cold
+    etags = {}
+    t = time.perf_counter()
+    await visit(client, paths, headers, etags)
+    cold = time.perf_counter() - t
+    requests = sent = not_modified = 0
+    t = time.perf_counter()
+    for _ in range(passes):
+        count, size, unchanged = await visit(client, paths, headers, etags if revalidate else {})
+        requests += count
+        sent += size
+        not_modified += unchanged
+    return cold, time.perf_counter() - t, requests, sent, not_modified
+
+
+async def run(passes: int):
+    plain = make_plain_app()
+    await plain.start()
+    await app.start()
+    paths = [f'/{key}' for key in assets.index]
+    ranges = [f'/{key}' for key, info in assets.index.items() if key.startswith('models/')]
+    total = sum(info.size for info in assets.index.values())
+    print(f'{len(paths)} assets, {total / 1024:.0f} KiB, brotli {"on" if brotli else "off"}')
+    scenarios = [
+        ('first visit', paths, {'accept-encoding': 'gzip, deflate, br'}, False),
+        ('no compression', paths, {'accept-encoding': 'identity'}, False),
+        ('revalidation', paths, {'accept-encoding': 'gzip, deflate, br'}, True),
+        ('range 8 KiB', ranges, {'accept-encoding': 'identity', 'range': 'bytes=0-8191'}, False),
+    ]
+    for name, scenario_paths, headers, revalidate in scenarios:
+        for label, target in (('today', plain), ('assets', app)):
+            client = TestClient(target)
+            cold, elapsed, requests, sent, not_modified = await run_scenario(client, scenario_paths, headers, passes, revalidate)
+            print(f'{name:<16} {label:<7} {requests / elapsed:8.0f} req/s  cold {len(scenario_paths) / cold:6.0f} req/s  '
+                  f'{sent / requests / 1024:8.1f} KiB/req out  {not_modified:5d} not modified')
+    print('versioned names from /api/assets are cached as immutable, repeat visits send no requests')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static asset throughput and bytes out, serve_files against asset routes')
+    parser.add_argument('--passes', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.passes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import json
+import random
+import time
+
+from blacksheep.settings.json import json_settings
+
+from benchmarks.rectangles import make_matrix
+from service.catalog import CatalogIndex, read_catalog
+from service.pipeline import calculate_rects
+from service.wire import pack_matrix, decode_calculation, encode_compact, packed_type
+
+
+def timed(function, repeat=5) -> tuple[float, object]:
+    best = None
+    result = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    catalog, version = read_catalog()
+    index = CatalogIndex(catalog)
+    for size in (100, 300):
+        matrix = make_matrix(size, size, seed=size)
+        values = {'name': 'bench', 'budget': 5_000_000, 'providers': ['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ']}
+        json_body = json.dumps({**values, 'matrix': matrix.tolist()}).encode()
+        packed_body = json.dumps({**values, 'shape': list(matrix.shape), 'matrix': pack_matrix(matrix)}).encode()
+        json_parse, _ = timed(lambda: decode_calculation(json_body, b'application/json'))
+        packed_parse, _ = timed(lambda: decode_calculation(packed_body, packed_type.encode()))
+
+        random.seed(size)
+        rects = calculate_rects(matrix.copy(), values['budget'], index, values['providers'])
+        json_dump, json_response = timed(lambda: json_settings.dumps([rect.as_dict() for rect in rects]).encode())
+        compact_dump, compact_response = timed(lambda: json_settings.dumps(encode_compact(rects, version)).encode())
+
+        print(f'{size}x{size} request: json {len(json_body)} B parse {json_parse * 1000:.2f} ms, '
+              f'packed {len(packed_body)} B parse {packed_parse * 1000:.2f} ms')
+        print(f'{size}x{size} response ({len(rects)} rects): json {len(json_response)} B serialize {json_dump * 1000:.2f} ms, '
+              f'compact {len(compact_response)} B serialize {compact_dump * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
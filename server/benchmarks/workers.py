@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from blacksheep.client import ClientSession
+from blacksheep.contents import JSONContent
+
+projects = ['Осенний бульвар 10к2', 'Осенний бульвар 2', 'Осенний бульвар 3', 'Осенний бульвар 5к2', 'Осенний бульвар 5к3']
+ages = {'sport': True, 'child': True, 'relax': True}
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, sessions_path: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        # empty path keeps sessions in memory of every process
+        'ADD_SESSIONS_PATH': sessions_path,
+        # one handler thread per process, processes are what is scaled,
+        # requests wait instead of being rejected
+        'ADD_WORKERS': '1',
+        'ADD_QUEUE_DEPTH': '1000',
+        'ADD_PROFILE_RATE': '0',
+    }
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'service.app:app', '--port', str(port), '--workers', str(workers), '--log-level', 'error'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env
+    )
+
+
+async def wait_ready(base_url: str, timeout: float):
+    started = time.perf_counter()
+    while True:
+        try:
+            async with ClientSession(base_url=base_url, http2=False) as client:
+                response = await client.get('/api/stats')
+                await response.read()
+                if response.status == 200:
+                    return
+                error = RuntimeError(f'/api/stats returned {response.status}')
+        except Exception as exception:
+            error = exception
+        if time.perf_counter() - started > timeout:
+            raise error
+        await asyncio.sleep(0.2)
+
+
+async def run_user(client: ClientSession, user: str, deadline: float, latencies: list[float]) -> tuple[int, int]:
+    # every user is sequential, so its counter has to grow by exactly one per state request
+    states = 0
+    errors = 0
+    number = 0
+    while time.perf_counter() < deadline:
+        t = time.perf_counter()
+        if number % 2 == 0:
+            response = await client.get(f'/api/{user}/state?catalog=0')
+            states += 1
+        else:
+            name = projects[(number // 2) % len(projects)]
+            response = await client.post(f'/api/{user}/generation', JSONContent({'name': name, 'age_groups': ages}))
+        await response.read()
+        latencies.append(time.perf_counter() - t)
+        if response.status != 200:
+            errors += 1
+        number += 1
+    return states, errors
+
+
+async def run_client(base_url: str, users: list[str], duration: float) -> tuple[list[float], dict[str, int], int]:
+    latencies = []
+    async with ClientSession(base_url=base_url, http2=False) as client:
+        deadline = time.perf_counter() + duration
+        results = await asyncio.gather(*[run_user(client, user, deadline, latencies) for user in users])
+    return latencies, {user: states for user, (states, _) in zip(users, results)}, sum(errors for _, errors in results)
+
+
+def client_process(base_url: str, users: list[str], duration: float):
+    return asyncio.run(run_client(base_url, users, duration))
+
+
+async def read_values(base_url: str, users: list[str]) -> dict[str, int]:
+    values = {}
+    async with ClientSession(base_url=base_url, http2=False) as client:
+        for user in users:
+            response = await client.get(f'/api/{user}/state?catalog=0')
+            values[user] = (await response.json())['value']
+    return values
+
+
+def run(workers: int, clients: int, users: int, duration: float, shared: bool) -> dict:
+    port = get_free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(workers, port, f'{directory}/sessions.db' if shared else '')
+        try:
+            asyncio.run(wait_ready(base_url, timeout=60))
+            names = [f'load-{workers}-{index}' for index in range(users)]
+            groups = [names[index::clients] for index in range(clients)]
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(clients, mp_context=context) as executor:
+                results = list(executor.map(client_process, [base_url] * clients, groups, [duration] * clients))
+            latencies = [latency for result in results for latency in result[0]]
+            states = {user: count for result in results for user, count in result[1].items()}
+            errors = sum(result[2] for result in results)
+            # fresh state starts at 42 and is incremented before it is returned
+            values = asyncio.run(read_values(base_url, names))
+            consistent = sum(1 for user in names if values[user] == 42 + states[user] + 1)
+        finally:
+            server.terminate()
+            server.wait()
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / duration,
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99)],
+        'errors': errors,
+        'consistent': consistent,
+        'users': users,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of uvicorn --workers N with shared SQLite sessions')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=4, help='load generating processes')
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--memory', action='store_true', help='sessions in memory of every process, as before')
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} cpus, {args.clients} client processes, {args.users} users, '
+          f'{"memory" if args.memory else "sqlite"} sessions')
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, args.clients, args.users, args.duration, not args.memory)
+        baseline = baseline or result['throughput']
+        print(f'{workers} workers: {result["throughput"]:8.1f} req/s  x{result["throughput"] / baseline:.2f}  '
+              f'p50 {result["p50"] * 1000:6.1f} ms  p99 {result["p99"] * 1000:6.1f} ms  '
+              f'errors {result["errors"]}  consistent users {result["consistent"]}/{result["users"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,15 @@
+import hashlib
 import json
 import os.path
-from collections import defaultdict
 import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
+import numpy as np
 import pyproj
-import shutil
+from PIL import Image, ImageOps
 # примеры паттернов площадок https://leber.ru/ru/playgrounds
 
 provider_name = {
@@ -31,125 +36,521 @@ provider_name = {
 }
 
 
-def convert_data():
-    proj_6335000 = pyproj.Proj(
-        '+proj=tmerc +ellps=bessel +towgs84=316.151,78.924,589.65,-1.57273,2.69209,2.34693,8.4507 +units=m +lon_0=37.5 +lat_0=55.66666666667 +k_0=1 +x_0=0 +y_0=0')
-    # pyproj.transformer.transform(proj_6335000, 'WGS84', polygon_point[0], polygon_point[1])
-    transformer = pyproj.Transformer.from_proj(proj_6335000, 'epsg:4326')
-    path = os.path.dirname(__file__)
+def read_rows(path: str, skip_header=True):
+    # lazily yields tab separated rows, file is never loaded at once
+    with open(path) as file:
+        if skip_header:
+            next(file, None)
+        for line in file:
+            yield line.split('\t')
 
-    areas_path = path + '/input/Перечень площадок с АСУ ОДС, ДКР коорд.csv'
-    polygons = {}
-    with open(areas_path) as areas_file:
-        for line in areas_file.readlines()[1:]:
-            values = line.split('\t')
-            if len(values) < 11 or values[0] == '':
-                continue
-            id = values[0]
+
+class FeaturesWriter:
+    # writes polygons.json object and polygons.ndjson lines feature by feature
+
+    def __init__(self, json_path: str, ndjson_path: str):
+        self.json_file = open(json_path, 'w')
+        self.ndjson_file = open(ndjson_path, 'w')
+        self.count = 0
+
+    def write(self, id: str, feature: str):
+        # feature comes JSON encoded, it is encoded once for both files
+        id = json.dumps(id)
+        self.json_file.write('{\n' if self.count == 0 else ',\n')
+        self.json_file.write(f'{id}: {feature}')
+        self.ndjson_file.write(f'{feature[:-1]}, "id": {id}}}\n')
+        self.count += 1
+
+    def close(self):
+        self.json_file.write('\n}\n' if self.count else '{}\n')
+        self.json_file.close()
+        self.ndjson_file.close()
+
+
+def get_signature(path: str) -> list[int]:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def hash_text(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    # signatures and content hashes of inputs processed by previous runs
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path) as file:
+                self.data = json.load(file)
+        except FileNotFoundError:
+            self.data = {}
+        self.summary = {}
+
+    @classmethod
+    def open(cls):
+        return cls(os.path.dirname(__file__) + '/output/manifest.json')
+
+    def section(self, name: str) -> dict:
+        return self.data.setdefault(name, {})
+
+    def count(self, section: str, action: str, amount: float = 1):
+        actions = self.summary.setdefault(section, {})
+        actions[action] = actions.get(action, 0) + amount
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(self.data, file, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+
+    def report(self):
+        for section, actions in self.summary.items():
+            touched = ', '.join(f'{action} {amount}' for action, amount in actions.items() if action != 'seconds')
+            if 'seconds' in actions:
+                touched += f' in {actions["seconds"]:.2f}s'
+            print(f'{section}: {touched}')
+
+
+def is_unchanged(entries: dict, key: str, path: str, outputs: list[str]) -> bool:
+    # mtime and size first, content hash only when they differ, entry is updated
+    signature = get_signature(path)
+    known = entries.get(key)
+    exists = all(os.path.exists(output) for output in outputs)
+    if known and exists and known['signature'] == signature:
+        return True
+    digest = hash_file(path)
+    entries[key] = {'signature': signature, 'hash': digest}
+    return bool(known and exists and known['hash'] == digest)
+
+
+def sync_file(manifest: Manifest, section: str, src: str, dst: str):
+    # unchanged files are skipped, changed ones hardlinked or copied if linking fails
+    key = os.path.relpath(dst, os.path.dirname(__file__))
+    if is_unchanged(manifest.section(section), key, src, [dst]):
+        manifest.count(section, 'skipped')
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        manifest.count(section, 'linked')
+    except OSError:
+        shutil.copy(src, dst)
+        manifest.count(section, 'copied')
+
+
+proj_6335000 = '+proj=tmerc +ellps=bessel +towgs84=316.151,78.924,589.65,-1.57273,2.69209,2.34693,8.4507 +units=m +lon_0=37.5 +lat_0=55.66666666667 +k_0=1 +x_0=0 +y_0=0'
+
+transformer = None
+
+
+def get_transformer() -> pyproj.Transformer:
+    # built once per process, workers of parallel mode get their own
+    global transformer
+    if transformer is None:
+        # pyproj.transformer.transform(proj_6335000, 'WGS84', polygon_point[0], polygon_point[1])
+        transformer = pyproj.Transformer.from_proj(pyproj.Proj(proj_6335000), 'epsg:4326')
+    return transformer
+
+
+def read_sites(rows):
+    for values in rows:
+        if len(values) < 12 or values[0] == '':
+            continue
+        yield values[0], values[11].strip()
+
+
+class PreviousFeatures:
+    # encoded features of the previous run, see FeaturesWriter, read lazily along registry rows,
+    # both are in row order, so lines of rows gone from registry are skipped on the way
+
+    def __init__(self, path: Optional[str]):
+        self.file = None
+        if path:
             try:
-                polygon = json.loads(values[11].strip())
-            except:
-                print('incorrect polygon')
-                continue
-            coordinates = []
-            for vertex in polygon[0]:
-                lat_lng = transformer.transform(*vertex)
-                lat, lng = lat_lng
-                coordinates.append([lng, lat])
-            polygons[id] = {
-                'type': 'Feature',
-                'properties': {},
-                'geometry': {
-                    'type': 'Polygon',
-                    'coordinates': [coordinates]
-                }
+                self.file = open(path)
+            except FileNotFoundError:
+                pass
+
+    def find(self, id: str) -> Optional[str]:
+        while self.file:
+            line = self.file.readline()
+            if not line:
+                self.close()
+                break
+            feature, line_id = line.rstrip('\n')[:-1].rsplit(', "id": ', 1)
+            if json.loads(line_id) == id:
+                return feature + '}'
+        return None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def plan_sites(sites, known: dict[str, str], previous: PreviousFeatures):
+    # previous feature is reused when polygon text of the row is unchanged
+    for id, text in sites:
+        digest = hash_text(text)
+        feature = previous.find(id) if known.get(id) == digest else None
+        yield id, text, digest, feature
+
+
+def chunked(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def transform_rings(rings: list[list]) -> list[list]:
+    # one PROJ call for all vertices of the chunk instead of one per vertex
+    counts = [len(ring) for ring in rings]
+    total = sum(counts)
+    xs = np.fromiter((vertex[0] for ring in rings for vertex in ring), float, total)
+    ys = np.fromiter((vertex[1] for ring in rings for vertex in ring), float, total)
+    lat, lng = get_transformer().transform(xs, ys)
+    points = np.column_stack((lng, lat)).tolist()
+    result = []
+    start = 0
+    for count in counts:
+        result.append(points[start:start + count])
+        start += count
+    return result
+
+
+def convert_sites(sites: list[tuple[str, str]]) -> list[Optional[tuple[str, int]]]:
+    # encoded feature and points count of every site, None for incorrect polygon
+    polygons = []
+    for id, text in sites:
+        try:
+            polygons.append(json.loads(text))
+        except:
+            print('incorrect polygon')
+            polygons.append(None)
+    rings = iter(transform_rings([polygon[0] for polygon in polygons if polygon is not None]))
+    result = []
+    for polygon in polygons:
+        if polygon is None:
+            result.append(None)
+            continue
+        coordinates = next(rings)
+        feature = json.dumps({
+            'type': 'Feature',
+            'properties': {},
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [coordinates]
             }
-    polygons_path = path + '/output/polygons.json'
-    with open(polygons_path, 'w') as polygons_file:
-        json.dump(polygons, polygons_file, indent=4)
+        })
+        result.append((feature, len(coordinates)))
+    return result
+
+
+def get_changed(chunk: list) -> list[tuple[str, str]]:
+    return [(id, text) for id, text, _, feature in chunk if feature is None]
+
+
+def convert_chunks(chunks, workers: int):
+    if workers <= 1:
+        for chunk in chunks:
+            yield chunk, convert_sites(get_changed(chunk))
+        return
+    # bounded window of chunks in flight keeps registry streaming and order stable
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(convert_sites, get_changed(chunk))))
+            if len(pending) >= workers * 2:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+def convert_data(workers: int = 1, chunk_size: int = 10_000, manifest: Manifest = None):
+    manifest = manifest or Manifest.open()
+    path = os.path.dirname(__file__)
+    started = time.perf_counter()
+
+    areas_path = path + '/input/Перечень площадок с АСУ ОДС, ДКР коорд.csv'
+    json_path = path + '/output/polygons.json'
+    ndjson_path = path + '/output/polygons.ndjson'
+    registry = manifest.section('registry')
+    if registry.get('projection') != proj_6335000:
+        registry.clear()
+        registry['projection'] = proj_6335000
+    if is_unchanged(registry, 'input', areas_path, [json_path, ndjson_path]):
+        manifest.count('registry', 'unchanged')
+        manifest.count('registry', 'seconds', time.perf_counter() - started)
+        manifest.save()
+        print('registry is unchanged')
+        return
+
+    known = registry.get('rows', {})
+    # previous outputs are read while new ones are written next to them, replaced on success only
+    previous = PreviousFeatures(ndjson_path if known else None)
+    rows = {}
+    points = 0
+    converted = 0
+    writer = FeaturesWriter(json_path + '.tmp', ndjson_path + '.tmp')
+    try:
+        sites = plan_sites(read_sites(read_rows(areas_path)), known, previous)
+        for chunk, results in convert_chunks(chunked(sites, chunk_size), workers):
+            results = iter(results)
+            for id, text, digest, feature in chunk:
+                if feature is None:
+                    result = next(results)
+                    if result is None:
+                        continue
+                    feature, count = result
+                    points += count
+                    converted += 1
+                writer.write(id, feature)
+                rows[id] = digest
+    finally:
+        writer.close()
+        previous.close()
+    os.replace(json_path + '.tmp', json_path)
+    os.replace(ndjson_path + '.tmp', ndjson_path)
+    registry['rows'] = rows
+    elapsed = time.perf_counter() - started
+    manifest.count('registry', 'converted', converted)
+    manifest.count('registry', 'reused', writer.count - converted)
+    manifest.count('registry', 'seconds', elapsed)
+    manifest.save()
+    print(f'converted {converted} of {writer.count} polygons, {points} points in {elapsed:.2f}s ({points / max(elapsed, 1e-9):.0f} points/s)')
 
 
-def parse_providers():
+def parse_providers(manifest: Manifest = None):
+    manifest = manifest or Manifest.open()
     path = os.path.dirname(__file__)
+    started = time.perf_counter()
     providers_path = path + '/input/Каталог 2024.tsv'
+    providers_result = path + '/output/providers.json'
     providers_data = {}
-    provider_costs = defaultdict(set)
-    sizes_x = []
-    sizes_y = []
+    # running aggregates, rows are not kept
+    sizes_min = [None, None]
+    sizes_max = [None, None]
     move_images = False
-    with open(providers_path) as providers_file:
-        for line in providers_file.readlines()[1:]:
-            values = line.split('\t')
+    if is_unchanged(manifest.section('providers'), 'input', providers_path, [providers_result]) and not move_images:
+        manifest.count('providers', 'unchanged')
+        manifest.count('providers', 'seconds', time.perf_counter() - started)
+        manifest.save()
+        print('catalog is unchanged')
+        return
+    for values in read_rows(providers_path):
+        img_uid = values[0]
+        number = values[2]
+        maf_cost = float(values[7])
+        code_name = values[9]
+        maf_type = values[10]
 
-            img_uid = values[0]
-            number = values[2]
-            maf_cost = float(values[7])
-            code_name = values[9]
-            maf_type = values[10]
+        try:
+            maf_size = [int(v) for v in values[5].split('x')]
+            size_x, size_y, size_z = maf_size
+            for axis, size in enumerate((size_x, size_y)):
+                if sizes_min[axis] is None or size < sizes_min[axis]:
+                    sizes_min[axis] = size
+                if sizes_max[axis] is None or size > sizes_max[axis]:
+                    sizes_max[axis] = size
+        except:
+            print('error', values[5])
 
-            try:
-                maf_size = [int(v) for v in values[5].split('x')]
-                size_x, size_y, size_z = maf_size
-                sizes_x.append(size_x)
-                sizes_y.append(size_y)
-            except:
-                print('error', values[5])
-
-            name = provider_name.get(code_name)
-            if not name:
-                continue
-            if name not in providers_data:
-                providers_data[name] = {
-                    'types': [],
-                    'min_cost': 0.0,
-                    'max_cost': 0.0
-                }
-            provider = providers_data[name]
-            if maf_type not in provider['types']:
-                provider['types'].append(maf_type)
-            provider_costs[name].add(maf_cost)
-            provider['min_cost'] = min(provider_costs[name])
-            provider['max_cost'] = max(provider_costs[name])
-
-            if move_images:
-                src_folder = path + '/input/Каталог/картинки 2024/'
-                dest_folder = path + '/output/images/' + name
-                os.makedirs(dest_folder, exist_ok=True)
-                img_src = src_folder + img_uid
-                ext = img_uid.split('.')[-1]
-                dst_name = number + '.' + ext
-                img_dst = dest_folder + '/' + dst_name
-                shutil.copy(img_src, img_dst)
+        name = provider_name.get(code_name)
+        if not name:
+            continue
+        if name not in providers_data:
+            providers_data[name] = {
+                'types': [],
+                'min_cost': maf_cost,
+                'max_cost': maf_cost
+            }
+        provider = providers_data[name]
+        if maf_type not in provider['types']:
+            provider['types'].append(maf_type)
+        provider['min_cost'] = min(provider['min_cost'], maf_cost)
+        provider['max_cost'] = max(provider['max_cost'], maf_cost)
+
+        if move_images:
+            src_folder = path + '/input/Каталог/картинки 2024/'
+            dest_folder = path + '/output/images/' + name
+            os.makedirs(dest_folder, exist_ok=True)
+            img_src = src_folder + img_uid
+            ext = img_uid.split('.')[-1]
+            dst_name = number + '.' + ext
+            img_dst = dest_folder + '/' + dst_name
+            sync_file(manifest, 'images', img_src, img_dst)
+        manifest.count('providers', 'parsed')
 
-    providers_result = path + '/output/providers.json'
     with open(providers_result, 'w') as providers_file:
         json.dump(providers_data, providers_file, indent=4, ensure_ascii=False)
-    sizes_x = sorted(sizes_x)
-    sizes_y = sorted(sizes_y)
-    # print('sizes_x', sizes_x)
-    # print('sizes_y', sizes_y)
-    print(f'min: {min(sizes_x)}x{min(sizes_y)}')
-    print(f'max: {max(sizes_x)}x{max(sizes_y)}')
+    manifest.count('providers', 'seconds', time.perf_counter() - started)
+    manifest.save()
+    print(f'min: {sizes_min[0]}x{sizes_min[1]}')
+    print(f'max: {sizes_max[0]}x{sizes_max[1]}')
 
 
-def move_images():
+catalog_names = ['catalog_child.json', 'catalog_sport.json', 'catalog_relax.json']
+
+
+def read_previews(manifest: Manifest) -> list[str]:
+    # previews of unchanged catalog are taken from manifest without parsing
+    path = os.path.dirname(__file__)
+    previews = []
+    for name in catalog_names:
+        catalog = path + '/../service/data/' + name
+        entry = manifest.section('catalogs').setdefault(name, {})
+        if is_unchanged(entry, 'input', catalog, []) and 'previews' in entry:
+            manifest.count('catalogs', 'unchanged')
+        else:
+            with open(catalog) as catalog_file:
+                entry['previews'] = [maf['preview'] for maf in json.load(catalog_file)]
+            manifest.count('catalogs', 'parsed')
+        previews += entry['previews']
+    return previews
+
+
+def move_images(manifest: Manifest = None):
+    manifest = manifest or Manifest.open()
     path = os.path.dirname(__file__)
-    catalogs = [
-        path + '/../service/data/catalog_child.json',
-        path + '/../service/data/catalog_sport.json',
-        path + '/../service/data/catalog_relax.json',
-    ]
+    started = time.perf_counter()
     output = path + '/../../web/public/preview/'
-    for catalog in catalogs:
-        with open(catalog) as catalog_file:
-            catalog = json.load(catalog_file)
-            for maf in catalog:
-                img = maf['preview']
-                src = path + '/input/Каталог/картинки 2024/' + img
-                dst = output + img
-                shutil.copy(src, dst)
+    for img in read_previews(manifest):
+        src = path + '/input/Каталог/картинки 2024/' + img
+        dst = output + img
+        sync_file(manifest, 'images', src, dst)
+    manifest.count('catalogs', 'seconds', time.perf_counter() - started)
+    manifest.save()
+
+
+thumbnail_widths = (160, 320, 640)
+thumbnail_formats = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def make_thumbnails(src: str, output: str, name: str) -> dict:
+    # catalog card sizes of one supplier image, never upscaled
+    stem = os.path.splitext(name)[0]
+    with Image.open(src) as image:
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    # jpeg has no alpha, transparent background becomes white as on cards
+    opaque = image
+    if image.mode == 'RGBA':
+        opaque = Image.new('RGB', image.size, (255, 255, 255))
+        opaque.paste(image, mask=image.getchannel('A'))
+    widths = [width for width in thumbnail_widths if width < image.width] or [image.width]
+    entry = {'width': image.width, 'height': image.height, 'sizes': {}}
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        sizes = entry['sizes'][str(width)] = {}
+        for ext, (format, options) in thumbnail_formats.items():
+            source = opaque if format == 'JPEG' else image
+            resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+            file_name = f'{stem}-{width}.{ext}'
+            temp = f'{output}/{file_name}.tmp'
+            resized.save(temp, format, **options)
+            os.replace(temp, f'{output}/{file_name}')
+            sizes[ext] = {'file': f'thumbs/{file_name}', 'bytes': os.path.getsize(f'{output}/{file_name}')}
+    return entry
+
+
+def get_thumbnail_files(entry: dict) -> list[str]:
+    return [size['file'] for sizes in entry['sizes'].values() for size in sizes.values()]
+
+
+def build_thumbnails(workers: int = os.cpu_count() or 1, manifest: Manifest = None):
+    # web/public/preview/thumbnails.json maps catalog preview to card sizes,
+    # file paths are relative to preview folder as maf.preview
+    manifest = manifest or Manifest.open()
+    path = os.path.dirname(__file__)
+    started = time.perf_counter()
+    preview = path + '/../../web/public/preview'
+    output = preview + '/thumbs'
+    index_path = preview + '/thumbnails.json'
+    os.makedirs(output, exist_ok=True)
+    try:
+        with open(index_path) as index_file:
+            previous = json.load(index_file)
+    except FileNotFoundError:
+        previous = {}
+    # thumbnails are rebuilt when sizes or encoder options change
+    options = hash_text(repr((thumbnail_widths, thumbnail_formats)))
+    sources = manifest.section('thumbnails')
+    if sources.get('options') != options:
+        sources.clear()
+        sources['options'] = options
+
+    thumbnails = {}
+    changed = []
+    for name in dict.fromkeys(read_previews(manifest)):
+        src = path + '/input/Каталог/картинки 2024/' + name
+        if not os.path.exists(src):
+            manifest.count('thumbnails', 'missing')
+            continue
+        outputs = [preview + '/' + file for file in get_thumbnail_files(previous[name])] if name in previous else []
+        # signature is recorded for new previews too
+        unchanged = is_unchanged(sources, name, src, outputs)
+        if unchanged and name in previous:
+            thumbnails[name] = previous[name]
+            manifest.count('thumbnails', 'skipped')
+        else:
+            changed.append((src, name))
+
+    if workers <= 1 or len(changed) <= 1:
+        results = [make_thumbnails(src, output, name) for src, name in changed]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(make_thumbnails, [src for src, _ in changed], [output] * len(changed), [name for _, name in changed]))
+    for (_, name), entry in zip(changed, results):
+        thumbnails[name] = entry
+        manifest.count('thumbnails', 'built')
+
+    # thumbnails of previews gone from catalogs are removed
+    kept = {file for entry in thumbnails.values() for file in get_thumbnail_files(entry)}
+    for entry in previous.values():
+        for file in get_thumbnail_files(entry):
+            if file not in kept and os.path.exists(preview + '/' + file):
+                os.remove(preview + '/' + file)
+                manifest.count('thumbnails', 'removed')
+
+    with open(index_path + '.tmp', 'w') as index_file:
+        json.dump(thumbnails, index_file, indent=4, ensure_ascii=False)
+    os.replace(index_path + '.tmp', index_path)
+    elapsed = time.perf_counter() - started
+    built = sum(size['bytes'] for _, name in changed for sizes in thumbnails[name]['sizes'].values() for size in sizes.values())
+    total = sum(size['bytes'] for entry in thumbnails.values() for sizes in entry['sizes'].values() for size in sizes.values())
+    manifest.count('thumbnails', 'seconds', elapsed)
+    manifest.save()
+    print(f'built thumbnails of {len(changed)} of {len(thumbnails)} previews, {built / 1024:.0f} KiB written, '
+          f'{total / 1024:.0f} KiB total in {elapsed:.2f}s')
 
 
 if __name__ == '__main__':
-    move_images()
-    # parse_providers()
+    manifest = Manifest.open()
+    move_images(manifest)
+    build_thumbnails(manifest=manifest)
+    # parse_providers(manifest)
+    # convert_data(manifest=manifest)
+    manifest.report()
@@ -1,18 +1,76 @@
+import math
+import os
+import time
 from dataclasses import dataclass
-from datetime import datetime
-from random import random, randint, choice
-from typing import Optional
+from typing import Callable, Optional, TypeVar
 
-import shapely
-from blacksheep import Application, get, FromQuery, post, FromJSON
+from blacksheep import Application, get, post, FromJSON, Request, Response, Content
+from blacksheep.exceptions import BadRequest, NotFound
 from blacksheep.server.files import get_default_extensions
+from blacksheep.server.responses import redirect
+from blacksheep.settings.json import json_settings
 from rodi import Container
-from shapely import Polygon, Point
+import numpy as np
+
+from service.assets import AssetStore, select_encoding, parse_range
+from service.metrics import metrics, stage, Profiler
+from service.pipeline import generate_tiles, plan_key, plan_rects, assign_plan, solvers
+from service.sessions import MemorySessionStore, SqliteSessionStore
+from service.state import Provider, State, Rect, as_local
+from service.wire import packed_type, accepts_packed, decode_calculation, encode_compact
+from service.workers import WorkerPool, WorkerPoolSaturated
+
+T = TypeVar('T')
+
+session_limits = dict(
+    max_entries=int(os.environ.get('ADD_SESSIONS_MAX_ENTRIES', 10_000)),
+    max_bytes=int(os.environ.get('ADD_SESSIONS_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=float(os.environ.get('ADD_SESSIONS_TTL', 24 * 60 * 60)),
+)
+# sessions database shared by processes of uvicorn --workers N, in process memory if not set
+sessions_path = os.environ.get('ADD_SESSIONS_PATH')
+if sessions_path:
+    sessions = SqliteSessionStore(sessions_path, State.encode, State.decode, **session_limits)
+else:
+    sessions = MemorySessionStore(sizeof=State.get_size, **session_limits)
+
+workers = int(os.environ.get('ADD_WORKERS', os.cpu_count() or 1))
+pool = WorkerPool(
+    workers=workers,
+    queue_depth=int(os.environ.get('ADD_QUEUE_DEPTH', workers * 4)),
+    retry_after=int(os.environ.get('ADD_RETRY_AFTER', 1))
+)
 
-from service.state import Provider, find_max_rectangles, Rect, Maf
+# shared sessions store may wait on locks of other processes, its I/O runs on own threads
+# so that neither event loop nor calculation pool waits with it
+session_pool = WorkerPool(
+    workers=int(os.environ.get('ADD_SESSIONS_WORKERS', 4)),
+    queue_depth=int(os.environ.get('ADD_SESSIONS_QUEUE_DEPTH', 256)),
+    retry_after=int(os.environ.get('ADD_RETRY_AFTER', 1))
+)
+
+artifacts_path = os.environ.get('ADD_ARTIFACTS_PATH', os.path.dirname(__file__) + '/data/artifacts')
+artifacts_max_files = int(os.environ.get('ADD_ARTIFACTS_MAX_FILES', 10_000))
+
+# opt-in, share of generation and calculation requests run under cProfile,
+# profiles of slower than threshold are dumped to path
+profiler = Profiler(
+    rate=float(os.environ.get('ADD_PROFILE_RATE', 0)),
+    threshold=float(os.environ.get('ADD_PROFILE_THRESHOLD', 1.0)),
+    path=os.environ.get('ADD_PROFILE_PATH', os.path.dirname(__file__) + '/data/profiles')
+)
+
+# models, previews and client bundle are served with content hashed names by asset routes,
+# unknown names under their folders are 404, other web files are left to serve_files,
+# compressed variants are built at startup or beforehand by python -m service.assets
+assets = AssetStore(
+    'web', ['models', 'preview', 'assets'],
+    cache_path=os.environ.get('ADD_ASSETS_CACHE', os.path.dirname(__file__) + '/data/assets')
+)
 
 dependencies = Container()
-dependencies.add_instance(Provider())
+dependencies.add_instance(Provider(sessions, artifacts_path or None, artifacts_max_files))
+dependencies.add_instance(pool)
 
 app = Application(services=dependencies)
 
@@ -33,343 +91,299 @@ app.use_cors(
 )
 
 
+async def request_timer(request: Request, handler):
+    # routes are labeled by pattern, static files share one label
+    t = time.perf_counter()
+    try:
+        return await handler(request)
+    finally:
+        match = app.router.get_match(request)
+        route = match.pattern.decode() if match else 'static'
+        metrics.observe('add_request_seconds', 'route', f'{request.method} {route}', time.perf_counter() - t)
+
+
+app.middlewares.append(request_timer)
+
+
+@app.exception_handler(WorkerPoolSaturated)
+async def service_busy(app: Application, request: Request, error: WorkerPoolSaturated):
+    return Response(
+        503,
+        [(b'Retry-After', str(error.retry_after).encode())],
+        Content(b'text/plain', b'Service is busy, retry later')
+    )
+
+
+def is_not_modified(request: Request, etag: bytes) -> bool:
+    header = request.get_first_header(b'If-None-Match')
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix(b'W/') for tag in header.split(b',')]
+    return etag in tags or b'*' in tags
+
+
+def catalog_response(request: Request, provider: Provider, cache_control: bytes) -> Response:
+    etag = f'"{provider.catalog.version}"'.encode()
+    headers = [(b'ETag', etag), (b'Cache-Control', cache_control)]
+    if is_not_modified(request, etag):
+        return Response(304, headers)
+    return Response(200, headers, Content(b'application/json', provider.catalog.payload))
+
+
+@get("/api/catalog")
+def catalog(request: Request, provider: Provider):
+    provider.catalog.get()
+    return catalog_response(request, provider, b'public, max-age=60, must-revalidate')
+
+
+@get("/api/catalog/{version}")
+def catalog_version(version: str, request: Request, provider: Provider):
+    provider.catalog.get()
+    if version != provider.catalog.version:
+        return redirect(f'/api/catalog/{provider.catalog.version}')
+    return catalog_response(request, provider, b'public, max-age=31536000, immutable')
+
+
+def asset_response(request: Request, folder: str, name: str) -> Response:
+    asset, version = assets.find(folder, name)
+    if asset is None:
+        raise NotFound()
+    info = asset.info
+    if version is not None and version != info.hash:
+        return redirect(f'/{folder}/{info.versioned_name}')
+    etag = f'"{info.hash}"'.encode()
+    if version is None:
+        cache_control = b'public, max-age=60, must-revalidate'
+    else:
+        cache_control = b'public, max-age=31536000, immutable'
+    headers = [
+        (b'ETag', etag),
+        (b'Cache-Control', cache_control),
+        (b'Vary', b'Accept-Encoding'),
+        (b'Accept-Ranges', b'bytes'),
+    ]
+    if is_not_modified(request, etag):
+        return Response(304, headers)
+    content_type = info.content_type.encode()
+    range_header = request.get_first_header(b'Range')
+    if range_header:
+        # ranges are served from identity variant only
+        if_range = request.get_first_header(b'If-Range')
+        if not if_range or if_range == etag:
+            data = asset.variants['identity']
+            byte_range = parse_range(range_header, len(data))
+            if byte_range is None:
+                headers.append((b'Content-Range', f'bytes */{len(data)}'.encode()))
+                return Response(416, headers)
+            start, end = byte_range
+            headers.append((b'Content-Range', f'bytes {start}-{end}/{len(data)}'.encode()))
+            return Response(206, headers, Content(content_type, data[start:end + 1]))
+    encoding = select_encoding(request.get_first_header(b'Accept-Encoding') or b'', asset.variants)
+    if encoding != 'identity':
+        headers.append((b'Content-Encoding', encoding.encode()))
+    return Response(200, headers, Content(content_type, asset.variants[encoding][:]))
+
+
+@get("/models/{name}")
+def model_asset(name: str, request: Request):
+    return asset_response(request, 'models', name)
+
+
+@get("/preview/{name}")
+def preview_asset(name: str, request: Request):
+    return asset_response(request, 'preview', name)
+
+
+@get("/assets/{name}")
+def bundle_asset(name: str, request: Request):
+    return asset_response(request, 'assets', name)
+
+
+@get("/api/assets")
+def assets_manifest(request: Request):
+    # plain path -> content hashed path, clients may load hashed ones to cache them forever
+    etag = f'"{assets.version}"'.encode()
+    headers = [(b'ETag', etag), (b'Cache-Control', b'public, max-age=60, must-revalidate')]
+    if is_not_modified(request, etag):
+        return Response(304, headers)
+    return Response(200, headers, Content(b'application/json', json_settings.dumps(assets.manifest).encode()))
+
+
+async def run_sessions(function: Callable[..., T], *args) -> T:
+    # memory store is not shared and never waits, it stays on event loop
+    if sessions.shared:
+        return await session_pool.run(function, *args)
+    return function(*args)
+
+
+def next_state(provider: Provider, user: str) -> State:
+    state = provider.get_state(user)
+    state.value += 1
+    provider.save_state(user, state)
+    return state
+
+
 @get("/api/{user}/state")
-def home(user: str, provider: Provider):
-    model = provider.get_state(user)
-    model.value += 1
-    return model.as_dict()
+async def home(user: str, request: Request, provider: Provider):
+    model = await run_sessions(next_state, provider, user)
+    # clients loading /api/catalog/{catalog_version} pass ?catalog=0
+    embed = request.query.get('catalog', ['1'])[0] not in ('0', 'false')
+    data = model.as_dict(provider.catalog.records if embed else None)
+    data['catalog_version'] = provider.catalog.version
+    return data
+
+
+def get_number(request: Request, name: str, default: float) -> float:
+    value = request.query.get(name, [None])[0]
+    if value is None:
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise BadRequest(f'Invalid {name}: {value}')
+    if not math.isfinite(number) or number < 0:
+        raise BadRequest(f'Invalid {name}: {value}')
+    return number
+
+
+@get("/api/sites")
+def sites(request: Request, provider: Provider):
+    # ?bbox=west,south,east,north of map viewport
+    try:
+        west, south, east, north = [float(value) for value in request.query['bbox'][0].split(',')]
+    except (KeyError, ValueError):
+        raise BadRequest('Invalid bbox, expected west,south,east,north')
+    limit = int(get_number(request, 'limit', 500))
+    index = provider.get_sites()
+    positions, total = index.find_in_bbox(west, south, east, north, limit)
+    return {
+        'type': 'FeatureCollection',
+        'total': total,
+        'features': [index.get_feature(position) for position in positions],
+    }
+
+
+@get("/api/sites/{id}/adjacent")
+def adjacent_sites(id: str, request: Request, provider: Provider):
+    distance = get_number(request, 'distance', 100)
+    limit = int(get_number(request, 'limit', 20))
+    index = provider.get_sites()
+    adjacent = index.find_adjacent(id, distance, limit)
+    if adjacent is None:
+        raise NotFound()
+    return {
+        'type': 'FeatureCollection',
+        'features': [index.get_feature(position, {'distance': round(meters, 2)}) for position, meters in adjacent],
+    }
 
 
 @dataclass
 class GenerationData:
     name: str
-    area: list[list[float]]
     age_groups: dict[str, bool]
+    # local metric area, projected from project geo polygon if not given
+    area: Optional[list[list[float]]] = None
 
 
 @post("/api/{user}/generation")
-def generate(user: str, data: FromJSON[GenerationData], provider: Provider):
-    state = provider.get_state(user)
+async def generate(user: str, data: FromJSON[GenerationData], provider: Provider, pool: WorkerPool):
+    state = await run_sessions(provider.get_state, user)
     patterns = provider.get_patterns()
     project = state.get_project(data.value.name)
     is_first_generation = state.last_project != project.name
     state.last_project = project.name
-    ages = data.value.age_groups
-    pattern_key = ''
-    pattern_key += '1' if ages['sport'] else '0'
-    pattern_key += '1' if ages['child'] else '0'
-    pattern_key += '1' if ages['relax'] else '0'
-    pattern_offset = {
-        '000': 0,
-        '100': 32,
-        '110': 64,
-        '101': 96,
-        '001': 128,
-        '011': 160,
-        '010': 192,
-        '111': 224,
-    }
-    area = Polygon(data.value.area)
-    ax, ay, area_w, area_h = area.bounds
-    data = []
-    atlas_w, atlas_h = patterns.size
-    pixels = patterns.load()
-    # print('w', area_w, atlas_w - area_w, 'h', area_h, 32 - area_h)
-    # randomize generation
+    area = data.value.area or as_local(project.geo_polygon)
+    offset = None
+    if is_first_generation:
+        offset = (0, 0)
+        await run_sessions(provider.save_state, user, state)
 
-    rxo = randint(0, 72 - int(area_w))
-    ryo = randint(0, 32 - int(area_h))
+    def generation():
+        site = provider.get_artifacts(project.name, area)
+        return generate_tiles(patterns, site, data.value.age_groups, offset)
 
-    if is_first_generation:
-        rxo = 0
-        ryo = 0
-    # ryo = 0
-    pattern_offset = pattern_offset[pattern_key]
-    for y in range(0, min(atlas_h, int(area_h))):
-        for x in range(0, min(atlas_w, int(area_w))):
-            r, g, b, a = pixels[x + rxo, y + ryo + pattern_offset]
-            if (r, g, b, a) == (255, 255, 255, 255):
-                continue
-            if not area.contains(Point(x + 0.25, y + 0.25)):
-                continue
-            tile = 'child'
-            if r == 255:
-                tile = 'sport'
-            if b == 255:
-                tile = 'relax'
-            data.append([[x, y], tile])
-    return data
+    return await pool.run(profiler.wrap('generation', generation))
 
 
 @dataclass
 class CalculationData:
     name: str
-    matrix: list[list[int]]
+    matrix: np.ndarray
     budget: int
     providers: list[str]
+    solver: str = 'greedy'
 
 
-@post("/api/{user}/calculation")
-def calculate(user: str, data: FromJSON[CalculationData], provider: Provider):
-    state = provider.get_state(user)
-    project = state.get_project(data.value.name)
-    matrix = data.value.matrix
+solver_timeout = float(os.environ.get('ADD_SOLVER_TIMEOUT', 0.1))
 
-    mapping = {
-        'sport': 1,
-        'child': 2,
-        'relax': 3,
+
+@post("/api/{user}/calculation")
+async def calculate(user: str, request: Request, provider: Provider, pool: WorkerPool):
+    await run_sessions(provider.get_state, user)
+    body = await request.read()
+    compact = accepts_packed(request.get_headers(b'Accept'))
+    return await pool.run(profiler.wrap('calculation', run_calculation), provider, body, request.content_type(), compact)
+
+
+def run_calculation(provider: Provider, body: bytes, content_type: bytes, compact: bool) -> Response:
+    # request body is decoded and response is encoded here, off the event loop
+    try:
+        with stage('decoding'):
+            values, matrix = decode_calculation(body, content_type)
+        data = CalculationData(
+            name=values['name'],
+            matrix=matrix,
+            budget=values['budget'],
+            providers=values['providers'],
+            solver=values.get('solver', 'greedy')
+        )
+        budget = data.budget
+        if isinstance(budget, bool) or not isinstance(budget, (int, float)) or not math.isfinite(budget) or budget < 0:
+            raise ValueError(f'budget must be a non-negative number, got {budget!r}')
+        if not isinstance(data.providers, list) or not all(isinstance(name, str) for name in data.providers):
+            raise ValueError('providers must be a list of strings')
+        if data.solver not in solvers:
+            raise ValueError(f'unknown solver {data.solver}')
+    except (ValueError, KeyError, TypeError, OverflowError) as error:
+        raise BadRequest(f'Invalid calculation data: {error}')
+    rects = calculate_cached(provider, data)
+    with stage('serialization'):
+        if compact:
+            content = Content(packed_type.encode(), json_settings.dumps(encode_compact(rects, provider.catalog.version)).encode())
+        else:
+            content = Content(b'application/json', json_settings.dumps([rect.as_dict() for rect in rects]).encode())
+    return Response(200, None, content)
+
+
+def calculate_cached(provider: Provider, data: CalculationData) -> list[Rect]:
+    matrix = data.matrix
+    budget = data.budget
+    key = plan_key(matrix)
+    plans = provider.plans.get(key)
+    if plans is None:
+        plans = plan_rects(matrix)
+        provider.plans.put(key, plans)
+    catalog = provider.catalog.get_index()
+    return assign_plan(plans, budget, catalog, data.providers, data.solver, solver_timeout)
+
+
+@get("/api/stats")
+def stats(provider: Provider, pool: WorkerPool):
+    return {
+        **provider.stats(),
+        'pool': pool.stats(),
+        'session_pool': session_pool.stats(),
     }
-    budget = {
-        1: 0,
-        2: 0,
-        3: 0
+
+
+@get("/metrics")
+def prometheus_metrics(provider: Provider, pool: WorkerPool):
+    gauges = {
+        **provider.stats(),
+        'pool': pool.stats(),
+        'session_pool': session_pool.stats(),
+        'profiler': {'dumps': profiler.dumps},
+        'static': assets.stats(),
     }
-    budget_total = data.value.budget
-    available_providers = data.value.providers
-    # print('calculate for budget', budget_total)
-    total_cells = 0
-    for row in data.value.matrix:
-        for cell in row:
-            if cell in budget:
-                budget[cell] += 1
-                total_cells += 1
-
-    if total_cells == 0:
-        return []
-
-    for marker in budget:
-        budget[marker] = budget[marker] / total_cells * budget_total
-
-    calculation = []
-    mapping_items = [
-        ('sport', 1),
-        ('child', 2),
-        ('relax', 3),
-    ]
-    last_primaries = []
-    for kind, marker in mapping_items:
-        kind_budget = budget[marker]
-        rectangles: list[Rect] = []
-        while found := find_max_rectangles(matrix, marker, min_area=1):
-            # remove found rectangle
-            sx, sy, w, h = found
-            for x in range(0, w):
-                for y in range(0, h):
-                    matrix[sy + y][sx + x] = 0
-            max_w = 11
-            max_h = 11
-            if w > max_w or h > max_h:
-                w_segments = [max_w] * (w // max_w)
-                w_remainder = w % max_w
-                if w_remainder > 0:
-                    w_segments.append(w_remainder)
-                h_segments = [max_h] * (h // max_h)
-                h_remainder = h % max_h
-                if h_remainder > 0:
-                    h_segments.append(h_remainder)
-
-                oy = sy
-                for h in h_segments:
-                    ox = sx
-                    for w in w_segments:
-                        rectangles.append(Rect(
-                            id=len(rectangles),
-                            position=(ox, oy),
-                            size=(w, h),
-                            weight=0.0,
-                            distance=0.0,
-                            budget=0.0,
-                            maf_kind=kind,
-                            maf=None,
-                            maf_budget=0.0,
-                            maf_rotation=0.0
-                        ))
-                        ox += w
-                    oy += h
-            else:
-                rectangles.append(Rect(
-                    id=len(rectangles),
-                    position=(sx, sy),
-                    size=(w, h),
-                    weight=0.0,
-                    distance=0.0,
-                    budget=0.0,
-                    maf_kind=kind,
-                    maf=None,
-                    maf_budget=0.0,
-                    maf_rotation=0.0
-                ))
-
-        if rectangles:
-            total_area = sum(rect.area for rect in rectangles)
-            # find_max_rectangles returns largest one first, 0 index valid
-            largest = rectangles[0]
-            primaries_max_diff = 0.15
-
-            primaries = [largest]
-            secondaries = []
-
-            for rect in rectangles[1:]:
-                if (1.0 - rect.area / largest.area) < primaries_max_diff:
-                    primaries.append(rect)
-                else:
-                    secondaries.append(rect)
-
-            primaries_area = sum(primary.area for primary in primaries)
-            primaries_total_weight = primaries_area / total_area
-
-            secondaries_total_weight = 1.0 - primaries_total_weight
-
-            for primary in primaries:
-                weight_part = primary.area / primaries_area
-                primary.weight = primaries_total_weight * weight_part
-                primary.distance = 0.0
-                primary.budget = int(kind_budget * primary.weight)
-
-            def find_closest_primary_distance(rect: Rect) -> float:
-                best_distance = None
-                center = Point(
-                    rect.position[0] + rect.size[0] / 2,
-                    rect.position[1] + rect.size[1] / 2
-                )
-                for primary in primaries:
-                    primary_center = Point(
-                        primary.position[0] + primary.size[0] / 2,
-                        primary.position[1] + primary.size[1] / 2
-                    )
-                    distance = shapely.distance(center, primary_center)
-                    if best_distance is None or distance < best_distance:
-                        best_distance = distance
-                return best_distance or 0.0
-
-            for secondary in secondaries:
-                secondary.distance = find_closest_primary_distance(secondary)
-
-            if len(secondaries) == 0:
-                secondaries_distance = 0.0
-            elif len(secondaries) == 1:
-                secondaries_distance = secondaries[0].distance
-            else:
-                # invert distance, closest rects gather higher weight
-                secondaries_distance = sum(secondary.distance for secondary in secondaries)
-                for secondary in secondaries:
-                    secondary.distance = secondaries_distance - secondary.distance
-                secondaries_distance = sum(secondary.distance for secondary in secondaries)
-
-            for secondary in secondaries:
-                weight_part = secondary.distance / secondaries_distance
-                secondary.weight = secondaries_total_weight * weight_part
-                secondary.budget = int(kind_budget * secondary.weight)
-
-            rotation_centers = []
-            randomize = True
-            if kind == 'relax':
-                rotation_centers = last_primaries
-                # if len(primaries) / len(rectangles) < 0.25:
-                #     rotation_centers += primaries
-                randomize = False
-            # assignment
-            catalog = [maf for maf in state.catalog if maf.category == kind and maf.provider in available_providers]
-            assign_mafs(rectangles, catalog, rotation_centers, randomize)
-            last_primaries = primaries
-
-        # add 1x1 rectangles
-        for y in range(len(matrix)):
-            row = matrix[y]
-            for x in range(len(row)):
-                if matrix[y][x] == marker:
-                    rectangles.append(Rect(
-                        id=len(rectangles),
-                        position=(x, y),
-                        size=(1, 1),
-                        weight=0.0,
-                        distance=0.0,
-                        budget=0.0,
-                        maf_kind=kind,
-                        maf=None,
-                        maf_budget=0.0,
-                        maf_rotation=0.0
-                    ))
-
-        calculation += rectangles
-    return calculation
-
-
-def assign_mafs(rectangles: list[Rect], catalog: list[Maf], rotation_centers: list[Rect], randomize=True):
-    catalog = list(sorted(catalog, key=lambda maf: maf.cost))
-
-    def find_maf_variants(budget: float, size: tuple[int, int]) -> list[tuple[Maf, bool, float]]:
-        def match_size(w, h):
-            return w <= size[0] < w * 3 and h <= size[1] < h * 3
-
-        variants = []
-        for maf in catalog:
-            if maf.cost < budget:
-                x, y = maf.tiles
-                if match_size(x, y):
-                    variants.append((maf, False, 0.0))
-                if match_size(y, x):
-                    variants.append((maf, True, 90.0))
-            else:
-                break
-        return variants
-
-    to_dominant = sorted(rectangles, key=lambda rectangle: rectangle.weight)
-    budget = 0.0
-    for rect in to_dominant:
-        budget += rect.budget
-        rect.maf_budget = budget
-        variants = find_maf_variants(budget, rect.size)
-        if variants:
-            # cheapest = variants[0]
-            # high cost =  maf, rotation = variants[-1]
-
-
-
-            rx, ry = rect.size
-
-            def get_variant_aspect(variant: tuple[Maf, bool, float]):
-                if variant[1]:
-                    my, mx = variant[0].tiles
-                else:
-                    mx, my = variant[0].tiles
-                return mx / rx + my / ry
-
-            variants = list(sorted(variants, key=lambda variant: get_variant_aspect(variant)))
-            # best aspect ratio match
-            if randomize or rect.size[0] == rect.size[1] == 2:
-                best_variant = choice(variants[-3:])
-            else:
-                best_variant = variants[-1]
-            maf, rotated, rotation = best_variant
-
-            if rotation_centers:
-                def find_closest_center(rect: Rect) -> Optional[Point]:
-                    best_distance = None
-                    best_center = None
-                    center = Point(
-                        rect.position[0] + rect.size[0] / 2,
-                        rect.position[1] + rect.size[1] / 2
-                    )
-                    for primary in rotation_centers:
-                        primary_center = Point(
-                            primary.position[0] + primary.size[0] / 2,
-                            primary.position[1] + primary.size[1] / 2
-                        )
-                        distance = shapely.distance(center, primary_center)
-                        if best_distance is None or distance < best_distance:
-                            best_distance = distance
-                            best_center = primary_center
-                    return best_center
-
-                center = find_closest_center(rect)
-                if center:
-                    if rotation == 90 and center.x < rect.position[0]:
-                        rotation = -90
-                    elif rotation == 0 and center.y < rect.position[1]:
-                        rotation = 180
-
-            budget -= maf.cost
-            rect.maf = maf
-            rect.maf_rotation = rotation * 0.017453
+    return Response(200, None, Content(b'text/plain; version=0.0.4', metrics.export(gauges).encode()))
+
@@ -0,0 +1,142 @@
+import hashlib
+import os.path
+from dataclasses import dataclass
+from threading import Lock, get_ident
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
+from shapely import Polygon
+
+from service.caches import LruCache
+from service.metrics import stage
+
+if TYPE_CHECKING:
+    from service.state import PatternAtlas
+
+
+@dataclass(slots=True)
+class SiteArtifacts:
+    # local metric polygon of site and everything derived from it once
+    area: Polygon
+    bounds: tuple[float, float, float, float]
+    coverage: np.ndarray
+
+
+def build_artifacts(patterns: 'PatternAtlas', area: list[list[float]]) -> SiteArtifacts:
+    polygon = Polygon(area)
+    with stage('containment'):
+        coverage = patterns.rasterize(polygon)
+    return SiteArtifacts(polygon, polygon.bounds, coverage)
+
+
+def artifacts_key(project: str, area: list[list[float]], patterns: 'PatternAtlas') -> str:
+    # coverage is clipped to atlas size, so atlas shape is part of key
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(project.encode())
+    digest.update(np.asarray(area, dtype=np.float64).tobytes())
+    digest.update(repr((len(area), patterns.kinds.shape)).encode())
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+
+    def __init__(self, patterns: 'PatternAtlas', path: Optional[str] = None, max_entries: int = 1024, max_files: int = 10_000):
+        self.patterns = patterns
+        # artifacts directory, memory only if not set
+        self.path = path
+        self.memory = LruCache(max_entries)
+        # areas come from clients, least recently used files above limit are removed,
+        # coverage is clipped to atlas size so every file is bounded too
+        self.max_files = max_files
+        self.lock = Lock()
+        self.reads = 0
+        self.writes = 0
+        self.evictions = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self.prune()
+
+    def get(self, project: str, area: list[list[float]]) -> SiteArtifacts:
+        key = artifacts_key(project, area, self.patterns)
+        artifacts = self.memory.get(key)
+        if artifacts is None:
+            artifacts = self.read(key)
+            if artifacts is None:
+                artifacts = build_artifacts(self.patterns, area)
+                self.write(key, artifacts)
+            self.memory.put(key, artifacts)
+        return artifacts
+
+    def read(self, key: str) -> Optional[SiteArtifacts]:
+        if not self.path:
+            return None
+        try:
+            with np.load(f'{self.path}/{key}.npz') as data:
+                polygon = Polygon(data['area'])
+                artifacts = SiteArtifacts(polygon, tuple(data['bounds'].tolist()), data['coverage'])
+            # modification time is last use for pruning
+            os.utime(f'{self.path}/{key}.npz')
+        except (OSError, ValueError, KeyError):
+            return None
+        with self.lock:
+            self.reads += 1
+        return artifacts
+
+    def write(self, key: str, artifacts: SiteArtifacts):
+        if not self.path:
+            return
+        path = f'{self.path}/{key}.npz'
+        temp = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+        try:
+            with open(temp, 'wb') as file:
+                np.savez(
+                    file,
+                    area=np.asarray(artifacts.area.exterior.coords, dtype=np.float64),
+                    bounds=np.asarray(artifacts.bounds, dtype=np.float64),
+                    coverage=artifacts.coverage
+                )
+            os.replace(temp, path)
+        except OSError as error:
+            print(f'unable to save site artifacts {path}: {error}')
+            return
+        with self.lock:
+            self.writes += 1
+            # directory is shared by processes, it is scanned now and then, not on each write
+            prune = self.writes % 100 == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        files = []
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.npz'):
+                        try:
+                            files.append((entry.stat().st_mtime, entry.path))
+                        except OSError:
+                            pass
+        except OSError as error:
+            print(f'unable to prune site artifacts {self.path}: {error}')
+            return
+        if len(files) <= self.max_files:
+            return
+        files.sort()
+        removed = 0
+        for _, path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self.lock:
+            self.evictions += removed
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                **self.memory.stats(),
+                'disk_reads': self.reads,
+                'disk_writes': self.writes,
+                'disk_evictions': self.evictions,
+            }
@@ -0,0 +1,187 @@
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import mmap
+import os.path
+from dataclasses import dataclass
+from typing import Optional
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+mimetypes.add_type('model/gltf-binary', '.glb')
+
+hash_length = 10
+
+# compressed variant is kept only if it saves at least that share
+min_saving = 0.1
+
+
+@dataclass(slots=True)
+class AssetInfo:
+    path: str
+    name: str
+    hash: str
+    size: int
+    content_type: str
+
+    @property
+    def versioned_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f'{stem}.{self.hash}{ext}'
+
+
+@dataclass(slots=True)
+class Asset:
+    info: AssetInfo
+    # encoding -> mapped file, identity always present
+    variants: dict[str, bytes | mmap.mmap]
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:hash_length]
+
+
+encoders = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+if brotli is not None:
+    encoders['br'] = lambda data: brotli.compress(data, quality=11)
+
+
+def map_file(path: str) -> bytes | mmap.mmap:
+    # pages are shared between worker processes through page cache
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def split_version(name: str) -> tuple[str, Optional[str]]:
+    # adanat-10008.3fa2c1d9e0.glb -> adanat-10008.glb, 3fa2c1d9e0
+    stem, ext = os.path.splitext(name)
+    base, dot, version = stem.rpartition('.')
+    if dot and len(version) == hash_length and all(char in '0123456789abcdef' for char in version):
+        return base + ext, version
+    return name, None
+
+
+class AssetStore:
+    # content hashed models, previews and bundles, encoded variants are precomputed
+    # once per content hash into cache directory and all files are memory mapped
+
+    def __init__(self, root: str, folders: list[str], cache_path: str):
+        self.root = root
+        self.folders = folders
+        self.cache_path = cache_path
+        self.index: dict[str, AssetInfo] = {}
+        self.assets: dict[str, Asset] = {}
+        self.encoded = 0
+        os.makedirs(cache_path, exist_ok=True)
+        for folder in folders:
+            directory = os.path.join(root, folder)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                    info = AssetInfo(path, name, hash_file(path), os.path.getsize(path), content_type)
+                    key = f'{folder}/{name}'
+                    self.index[key] = info
+                    self.assets[key] = Asset(info, self.load_variants(info))
+        self.manifest = {
+            key: f'{key.rpartition("/")[0]}/{info.versioned_name}'
+            for key, info in self.index.items()
+        }
+        digest = hashlib.blake2b(repr(sorted(self.manifest.items())).encode(), digest_size=8)
+        self.version = digest.hexdigest()
+
+    def load_variants(self, info: AssetInfo) -> dict[str, bytes | mmap.mmap]:
+        variants = {'identity': map_file(info.path)}
+        data = None
+        for encoding, encode in encoders.items():
+            path = f'{self.cache_path}/{info.hash}.{encoding}'
+            if not os.path.exists(path):
+                if data is None:
+                    with open(info.path, 'rb') as file:
+                        data = file.read()
+                # other workers may encode same file at once, each file is replaced whole
+                temp = f'{path}.{os.getpid()}.tmp'
+                with open(temp, 'wb') as file:
+                    file.write(encode(data))
+                os.replace(temp, path)
+                self.encoded += 1
+            # compressed variant is kept only if it saves enough
+            if os.path.getsize(path) <= info.size * (1 - min_saving):
+                variants[encoding] = map_file(path)
+        return variants
+
+    def find(self, folder: str, name: str) -> tuple[Optional[Asset], Optional[str]]:
+        name, version = split_version(name)
+        return self.assets.get(f'{folder}/{name}'), version
+
+    def stats(self) -> dict:
+        return {
+            'assets': len(self.index),
+            'bytes': sum(info.size for info in self.index.values()),
+            'encoded': self.encoded,
+        }
+
+
+def select_encoding(accept_encoding: bytes, variants: dict[str, bytes]) -> str:
+    # q values are honoured only for refusal, preference is br, gzip, identity
+    accepted = set()
+    for part in accept_encoding.decode('latin-1').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip())
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+def parse_range(header: bytes, size: int) -> Optional[tuple[int, int]]:
+    # single bytes range as inclusive start and end, None if not satisfiable
+    unit, _, spec = header.decode('latin-1').partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    start, dash, end = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not start:
+            length = int(end)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size or last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds compressed variants of web assets ahead of server start')
+    parser.add_argument('--root', default='web')
+    parser.add_argument('--folders', nargs='+', default=['models', 'preview', 'assets'])
+    parser.add_argument('--cache', default=os.path.dirname(__file__) + '/data/assets')
+    args = parser.parse_args()
+    store = AssetStore(args.root, args.folders, args.cache)
+    stats = store.stats()
+    print(f'{stats["assets"]} assets, {stats["encoded"]} variants built in {args.cache}')
+
+
+if __name__ == '__main__':
+    main()
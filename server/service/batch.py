@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+import numpy as np
+
+from service.artifacts import build_artifacts
+from service.pipeline import generate_tiles, calculate_rects
+from service.catalog import CatalogIndex, read_catalog
+from service.state import base_path, as_local, PatternAtlas
+
+tile_codes = {
+    'sport': 1,
+    'child': 2,
+    'relax': 3,
+}
+
+worker_patterns: Optional[PatternAtlas] = None
+worker_catalog: Optional[CatalogIndex] = None
+
+
+def init_worker():
+    global worker_patterns, worker_catalog
+    worker_patterns = PatternAtlas.load(base_path + '/data/patterns.png')
+    catalog, _ = read_catalog()
+    worker_catalog = CatalogIndex(catalog)
+
+
+def as_matrix(tiles: list) -> np.ndarray:
+    if not tiles:
+        return np.zeros((0, 0), dtype=np.int8)
+    w = max(x for (x, y), tile in tiles) + 1
+    h = max(y for (x, y), tile in tiles) + 1
+    matrix = np.zeros((h, w), dtype=np.int8)
+    for (x, y), tile in tiles:
+        matrix[y][x] = tile_codes[tile]
+    return matrix
+
+
+def process_site(task: tuple) -> dict:
+    site_id, geometry, options = task
+    random.seed(f'{options["seed"]}:{site_id}')
+    timings = {}
+    result = {'id': site_id}
+    t = time.perf_counter()
+    try:
+        site = build_artifacts(worker_patterns, as_local(geometry))
+        square = site.area.area
+        budget = int(square * options['budget_per_meter'])
+
+        tiles = generate_tiles(worker_patterns, site, options['age_groups'], offset=(0, 0))
+        timings['generation'] = time.perf_counter() - t
+
+        stage = time.perf_counter()
+        rects = calculate_rects(as_matrix(tiles), budget, worker_catalog, options['providers'])
+        timings['calculation'] = time.perf_counter() - stage
+
+        mafs = [rect for rect in rects if rect.maf]
+        result.update({
+            'square': round(square, 2),
+            'budget': budget,
+            'tiles': len(tiles),
+            'rects': len(rects),
+            'cost': round(sum(rect.maf.cost for rect in mafs), 2),
+            'mafs': [
+                [rect.maf.key, *rect.position, *rect.size, rect.maf_rotation]
+                for rect in mafs
+            ],
+        })
+    except Exception as error:
+        result['error'] = repr(error)
+    timings['total'] = time.perf_counter() - t
+    result['timings'] = {stage: round(value, 6) for stage, value in timings.items()}
+    return result
+
+
+def read_sites(polygons_path: str) -> Iterator[tuple[str, dict]]:
+    with open(polygons_path) as polygons_file:
+        if polygons_path.endswith('.ndjson'):
+            for line in polygons_file:
+                feature = json.loads(line)
+                yield feature['id'], feature['geometry']
+        else:
+            for site_id, feature in json.load(polygons_file).items():
+                yield site_id, feature['geometry']
+
+
+def run_batch(
+    polygons_path: str,
+    output_path: str,
+    workers: Optional[int] = None,
+    options: dict = None
+):
+    options = {
+        'seed': 42,
+        'budget_per_meter': 1000.0,
+        'providers': ['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ'],
+        'age_groups': {'sport': True, 'child': True, 'relax': True},
+        **(options or {})
+    }
+    sites = read_sites(polygons_path)
+    tasks = [(site_id, geometry, options) for site_id, geometry in sites]
+    workers = workers or os.cpu_count()
+    chunksize = max(1, min(32, len(tasks) // (workers * 4)))
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    t = time.perf_counter()
+    failed = 0
+    slowest = []
+    with open(output_path, 'w') as output_file:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            for result in executor.map(process_site, tasks, chunksize=chunksize):
+                output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                total = result['timings']['total']
+                if 'error' in result:
+                    failed += 1
+                    print(f'site {result["id"]}: error {result["error"]}')
+                else:
+                    print(f'site {result["id"]}: {result["tiles"]} tiles, {len(result["mafs"])} mafs, {total * 1000:.1f} ms')
+                slowest.append((total, result['id']))
+    elapsed = time.perf_counter() - t
+    slowest = sorted(slowest, reverse=True)[:5]
+    print(f'processed {len(tasks)} sites ({failed} failed) in {elapsed:.2f} s on {workers} workers, {len(tasks) / elapsed:.1f} sites/s')
+    print('slowest: ' + ', '.join(f'{site_id} {total * 1000:.1f} ms' for total, site_id in slowest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch generation and calculation over all sites')
+    parser.add_argument('--polygons', default=base_path + '/../data/output/polygons.json')
+    parser.add_argument('--output', default=base_path + '/../data/output/batch.ndjson')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--budget-per-meter', type=float, default=1000.0)
+    parser.add_argument('--providers', nargs='+', default=['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ'])
+    args = parser.parse_args()
+    run_batch(args.polygons, args.output, args.workers, {
+        'seed': args.seed,
+        'budget_per_meter': args.budget_per_meter,
+        'providers': args.providers,
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import bisect
+import hashlib
+import json
+import os.path
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional
+
+base_path = os.path.dirname(__file__)
+
+
+@dataclass(frozen=True, slots=True)
+class Maf:
+    name: str
+    key: str
+    provider: str
+    number: str
+    code: str
+    category: str
+    cost: float
+    preview: str
+    model: str
+    size: list[int]
+    safe: list[int]
+    tiles: list[int]
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'key': self.key,
+            'provider': self.provider,
+            'number': self.number,
+            'code': self.code,
+            'category': self.category,
+            'cost': self.cost,
+            'preview': self.preview,
+            'model': self.model,
+            'size': self.size,
+            'safe': self.safe,
+            'tiles': self.tiles,
+        }
+
+
+MafVariant = tuple[Maf, bool, float]
+
+
+class FootprintBucket:
+
+    def __init__(self, tiles: tuple[int, int]):
+        self.tiles = tiles
+        # sorted by cost, rank is position in whole catalog sorted by cost
+        self.costs: list[float] = []
+        self.ranks: list[int] = []
+        self.mafs: list[Maf] = []
+
+
+class CatalogSelection:
+
+    def __init__(self, buckets: list[FootprintBucket]):
+        self.buckets = buckets
+
+    def find_variants(self, budget: float, size: tuple[int, int]) -> list[MafVariant]:
+        def match_size(w, h):
+            return w <= size[0] < w * 3 and h <= size[1] < h * 3
+
+        found = []
+        for bucket in self.buckets:
+            x, y = bucket.tiles
+            direct = match_size(x, y)
+            rotated = match_size(y, x)
+            if not direct and not rotated:
+                continue
+            affordable = bisect.bisect_left(bucket.costs, budget)
+            for i in range(affordable):
+                maf = bucket.mafs[i]
+                if direct:
+                    found.append((bucket.ranks[i], 0, (maf, False, 0.0)))
+                if rotated:
+                    found.append((bucket.ranks[i], 1, (maf, True, 90.0)))
+        # cheapest first, same order as scan of catalog sorted by cost
+        found.sort(key=lambda item: (item[0], item[1]))
+        return [variant for rank, rotated, variant in found]
+
+
+class CatalogIndex:
+
+    def __init__(self, catalog: tuple[Maf, ...]):
+        # (category, provider) -> tiles -> bucket
+        self.groups: dict[tuple[str, str], dict[tuple[int, int], FootprintBucket]] = {}
+        # keyed by known providers only, at most one selection per subset of them
+        self.selections: dict[tuple[str, frozenset], CatalogSelection] = {}
+        self.providers = frozenset(maf.provider for maf in catalog)
+        for rank, maf in enumerate(sorted(catalog, key=lambda maf: maf.cost)):
+            group = self.groups.setdefault((maf.category, maf.provider), {})
+            tiles = (maf.tiles[0], maf.tiles[1])
+            bucket = group.get(tiles)
+            if bucket is None:
+                bucket = group[tiles] = FootprintBucket(tiles)
+            bucket.costs.append(maf.cost)
+            bucket.ranks.append(rank)
+            bucket.mafs.append(maf)
+
+    def select(self, category: str, providers: list[str]) -> CatalogSelection:
+        key = (category, self.providers.intersection(providers))
+        selection = self.selections.get(key)
+        if selection is None:
+            buckets = []
+            for provider in key[1]:
+                buckets += self.groups.get((category, provider), {}).values()
+            selection = self.selections[key] = CatalogSelection(buckets)
+        return selection
+
+
+catalog_paths = [
+    base_path + '/data/catalog_child.json',
+    base_path + '/data/catalog_sport.json',
+    base_path + '/data/catalog_relax.json',
+]
+
+
+def read_catalog(paths: list[str] = None) -> tuple[tuple[Maf, ...], str]:
+    catalog = []
+    digest = hashlib.sha1()
+    for path in paths or catalog_paths:
+        with open(path, 'rb') as catalog_file:
+            content = catalog_file.read()
+            digest.update(content)
+            records = json.loads(content)
+            for record in records:
+                maf = Maf(**record)
+                catalog.append(maf)
+    return tuple(catalog), digest.hexdigest()[:16]
+
+
+# process-wide read-only catalog shared by all user states,
+# reloaded when any of catalog files changes on disk
+class CatalogStore:
+
+    def __init__(self, paths: list[str] = None):
+        self.paths = paths or catalog_paths
+        self.lock = Lock()
+        self.signature = None
+        self.catalog: tuple[Maf, ...] = ()
+        self.version = ''
+        self.index: Optional[CatalogIndex] = None
+        # serialized once per version, shared by all responses
+        self.records: list[dict] = []
+        self.payload = b''
+
+    def get_signature(self) -> tuple:
+        signature = []
+        for path in self.paths:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self) -> tuple[Maf, ...]:
+        with self.lock:
+            signature = self.get_signature()
+            self.catalog, self.version = read_catalog(self.paths)
+            self.index = CatalogIndex(self.catalog)
+            self.records = [maf.as_dict() for maf in self.catalog]
+            self.payload = json.dumps(self.records, ensure_ascii=False, separators=(',', ':')).encode()
+            self.signature = signature
+        return self.catalog
+
+    def get(self) -> tuple[Maf, ...]:
+        if self.signature != self.get_signature():
+            return self.reload()
+        return self.catalog
+
+    def get_index(self) -> CatalogIndex:
+        self.get()
+        return self.index
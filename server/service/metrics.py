@@ -0,0 +1,130 @@
+import cProfile
+import os.path
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple[float, ...] = default_buckets):
+        self.buckets = buckets
+        # last count is +Inf bucket, counts are not cumulative until exported
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = Lock()
+        # (metric, label, value) -> histogram
+        self.histograms: dict[tuple[str, str, str], Histogram] = {}
+
+    def observe(self, metric: str, label: str, value: str, seconds: float):
+        key = (metric, label, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def export(self, gauges: dict) -> str:
+        # prometheus text exposition format
+        lines = []
+        with self.lock:
+            families = {}
+            for (metric, label, value), histogram in sorted(self.histograms.items()):
+                families.setdefault(metric, []).append((label, value, histogram))
+            for metric, histograms in families.items():
+                lines.append(f'# TYPE {metric} histogram')
+                for label, value, histogram in histograms:
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{label}="{value}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{{label}="{value}"}} {histogram.count}')
+        for name, value in flatten('add', gauges):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def flatten(prefix: str, values: dict):
+    for key, value in values.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, dict):
+            yield from flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def stage(name: str):
+    # stage timer of generation and calculation, shared by app and batch
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('add_stage_seconds', 'stage', name, time.perf_counter() - t)
+
+
+class Profiler:
+
+    def __init__(self, rate: float = 0.0, threshold: float = 1.0, path: Optional[str] = None):
+        # share of requests profiled, only slower than threshold are dumped
+        self.rate = rate
+        self.threshold = threshold
+        self.path = path
+        self.dumps = 0
+        # own generator, global one is seeded by generation
+        self.random = random.Random()
+        self.active = Lock()
+        if rate > 0 and path:
+            os.makedirs(path, exist_ok=True)
+
+    def wrap(self, name: str, function: Callable[..., T]) -> Callable[..., T]:
+        if self.rate <= 0 or not self.path or self.random.random() >= self.rate:
+            return function
+
+        def profiled(*args) -> T:
+            # profiler is enabled in worker thread running function, one profile at a time
+            if not self.active.acquire(blocking=False):
+                return function(*args)
+            profile = cProfile.Profile()
+            t = time.perf_counter()
+            try:
+                return profile.runcall(function, *args)
+            finally:
+                elapsed = time.perf_counter() - t
+                self.active.release()
+                if elapsed >= self.threshold:
+                    self.dump(name, elapsed, profile)
+
+        return profiled
+
+    def dump(self, name: str, elapsed: float, profile: cProfile.Profile):
+        # pstats file, readable with snakeviz or flameprof
+        path = f'{self.path}/{name}-{time.strftime("%Y%m%d-%H%M%S")}-{elapsed * 1000:.0f}ms-{os.getpid()}.prof'
+        try:
+            profile.dump_stats(path)
+            self.dumps += 1
+        except OSError as error:
+            print(f'unable to dump profile {path}: {error}')
@@ -0,0 +1,367 @@
+import hashlib
+import math
+import time
+from dataclasses import dataclass, replace
+from random import randint, choice
+from typing import Optional
+
+import numpy as np
+
+from service.artifacts import SiteArtifacts
+from service.catalog import CatalogIndex, CatalogSelection, MafVariant
+from service.metrics import stage
+from service.state import decompose_rectangles, Rect, PatternAtlas, get_pattern_key, tile_kinds
+
+
+def generate_tiles(
+    patterns: PatternAtlas,
+    site: SiteArtifacts,
+    ages: dict[str, bool],
+    offset: Optional[tuple[int, int]] = None
+) -> list:
+    pattern_key = get_pattern_key(ages)
+    ax, ay, area_w, area_h = site.bounds
+    coverage = site.coverage
+    data = []
+    # randomize generation
+    if offset is None:
+        rxo = randint(0, max(0, 72 - int(area_w)))
+        ryo = randint(0, max(0, 32 - int(area_h)))
+    else:
+        rxo, ryo = offset
+    h, w = coverage.shape
+    with stage('sampling'):
+        tiles = patterns.sample(pattern_key, rxo, ryo, w, h)
+        for y, x in np.argwhere(coverage & (tiles > 0)).tolist():
+            data.append([[x, y], tile_kinds[tiles[y, x]]])
+    return data
+
+
+@dataclass
+class KindPlan:
+    kind: str
+    # share of kind in total budget, rect weights are shares of kind budget
+    share: float
+    rectangles: list[Rect]
+    primaries: list[int]
+    singles: list[Rect]
+
+
+def get_centers(rectangles: list[Rect]) -> np.ndarray:
+    centers = [
+        (rect.position[0] + rect.size[0] / 2, rect.position[1] + rect.size[1] / 2)
+        for rect in rectangles
+    ]
+    return np.array(centers, dtype=np.float64).reshape(-1, 2)
+
+
+def find_closest(points: np.ndarray, centers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # distance to closest center and its index for every point, first one wins on ties
+    deltas = points[:, np.newaxis, :] - centers[np.newaxis, :, :]
+    distances = np.sqrt((deltas ** 2).sum(axis=2))
+    closest = distances.argmin(axis=1)
+    return distances[np.arange(len(points)), closest], closest
+
+
+def plan_key(matrix: np.ndarray) -> str:
+    # plan does not depend on budget, it is applied on assignment
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(matrix, dtype=np.int8).tobytes())
+    digest.update(repr(matrix.shape).encode())
+    return digest.hexdigest()
+
+
+def plan_rects(matrix: np.ndarray) -> list[KindPlan]:
+    # deterministic part of calculation, matrix is consumed
+    mapping = {
+        'sport': 1,
+        'child': 2,
+        'relax': 3,
+    }
+    share = {
+        1: 0,
+        2: 0,
+        3: 0
+    }
+    total_cells = 0
+    for marker in share:
+        share[marker] = int(np.count_nonzero(matrix == marker))
+        total_cells += share[marker]
+
+    if total_cells == 0:
+        return []
+
+    for marker in share:
+        share[marker] = share[marker] / total_cells
+
+    plans = []
+    mapping_items = [
+        ('sport', 1),
+        ('child', 2),
+        ('relax', 3),
+    ]
+    for kind, marker in mapping_items:
+        rectangles: list[Rect] = []
+        with stage('decomposition'):
+            found_rectangles = decompose_rectangles(matrix, marker, min_area=1)
+        for found in found_rectangles:
+            sx, sy, w, h = found
+            max_w = 11
+            max_h = 11
+            if w > max_w or h > max_h:
+                w_segments = [max_w] * (w // max_w)
+                w_remainder = w % max_w
+                if w_remainder > 0:
+                    w_segments.append(w_remainder)
+                h_segments = [max_h] * (h // max_h)
+                h_remainder = h % max_h
+                if h_remainder > 0:
+                    h_segments.append(h_remainder)
+
+                oy = sy
+                for h in h_segments:
+                    ox = sx
+                    for w in w_segments:
+                        rectangles.append(Rect(
+                            id=len(rectangles),
+                            position=(ox, oy),
+                            size=(w, h),
+                            weight=0.0,
+                            distance=0.0,
+                            budget=0.0,
+                            maf_kind=kind,
+                            maf=None,
+                            maf_budget=0.0,
+                            maf_rotation=0.0
+                        ))
+                        ox += w
+                    oy += h
+            else:
+                rectangles.append(Rect(
+                    id=len(rectangles),
+                    position=(sx, sy),
+                    size=(w, h),
+                    weight=0.0,
+                    distance=0.0,
+                    budget=0.0,
+                    maf_kind=kind,
+                    maf=None,
+                    maf_budget=0.0,
+                    maf_rotation=0.0
+                ))
+
+        primaries = []
+        if rectangles:
+            with stage('weighting'):
+                areas = np.array([rect.area for rect in rectangles])
+                total_area = areas.cumsum()[-1]
+                # find_max_rectangles returns largest one first, 0 index valid
+                largest = areas[0]
+                primaries_max_diff = 0.15
+
+                is_primary = (1.0 - areas / largest) < primaries_max_diff
+                is_primary[0] = True
+                primary_ids = np.flatnonzero(is_primary)
+                secondary_ids = np.flatnonzero(~is_primary)
+
+                primaries_area = areas[primary_ids].cumsum()[-1]
+                primaries_total_weight = primaries_area / total_area
+
+                secondaries_total_weight = 1.0 - primaries_total_weight
+
+                weights = np.zeros(len(rectangles))
+                distances = np.zeros(len(rectangles))
+                weights[primary_ids] = primaries_total_weight * (areas[primary_ids] / primaries_area)
+
+                if len(secondary_ids):
+                    centers = get_centers(rectangles)
+                    secondaries_distances, _ = find_closest(centers[secondary_ids], centers[primary_ids])
+                    if len(secondary_ids) > 1:
+                        # invert distance, closest rects gather higher weight
+                        secondaries_distances = secondaries_distances.cumsum()[-1] - secondaries_distances
+                    secondaries_distance = secondaries_distances.cumsum()[-1]
+                    distances[secondary_ids] = secondaries_distances
+                    weights[secondary_ids] = secondaries_total_weight * (secondaries_distances / secondaries_distance)
+
+                for rect, weight, distance in zip(rectangles, weights.tolist(), distances.tolist()):
+                    rect.weight = weight
+                    rect.distance = distance
+                primaries = [rectangles[i] for i in primary_ids.tolist()]
+
+        # add 1x1 rectangles
+        singles = []
+        for y, x in np.argwhere(matrix == marker).tolist():
+            singles.append(Rect(
+                id=len(rectangles) + len(singles),
+                position=(x, y),
+                size=(1, 1),
+                weight=0.0,
+                distance=0.0,
+                budget=0.0,
+                maf_kind=kind,
+                maf=None,
+                maf_budget=0.0,
+                maf_rotation=0.0
+            ))
+
+        plans.append(KindPlan(kind, share[marker], rectangles, [primary.id for primary in primaries], singles))
+    return plans
+
+
+solvers = ['greedy', 'optimal']
+
+
+def assign_plan(
+    plans: list[KindPlan],
+    budget_total: int,
+    catalog: CatalogIndex,
+    available_providers: list[str],
+    solver='greedy',
+    timeout=0.1
+) -> list[Rect]:
+    # plans are shared, assignment works on copies of rectangles
+    with stage('assignment'):
+        deadline = time.perf_counter() + timeout
+        calculation = []
+        last_primaries = []
+        for plan in plans:
+            kind = plan.kind
+            kind_budget = plan.share * budget_total
+            rectangles = [replace(rect, budget=int(kind_budget * rect.weight)) for rect in plan.rectangles]
+            if rectangles:
+                primaries = [rectangles[i] for i in plan.primaries]
+                rotation_centers = []
+                randomize = True
+                if kind == 'relax':
+                    rotation_centers = last_primaries
+                    # if len(primaries) / len(rectangles) < 0.25:
+                    #     rotation_centers += primaries
+                    randomize = False
+                # assignment, optimal solver falls back to greedy when out of time
+                selection = catalog.select(kind, available_providers)
+                if solver != 'optimal' or not assign_optimal(rectangles, selection, rotation_centers, deadline):
+                    assign_mafs(rectangles, selection, rotation_centers, randomize)
+                last_primaries = primaries
+            calculation += rectangles
+            calculation += plan.singles
+    return calculation
+
+
+def calculate_rects(matrix: np.ndarray, budget_total: int, catalog: CatalogIndex, available_providers: list[str]) -> list[Rect]:
+    return assign_plan(plan_rects(matrix), budget_total, catalog, available_providers)
+
+
+def find_closest_centers(rectangles: list[Rect], rotation_centers: list[Rect]) -> dict[int, list[float]]:
+    closest_centers = {}
+    if rotation_centers:
+        centers = get_centers(rotation_centers)
+        _, closest = find_closest(get_centers(rectangles), centers)
+        for rect, index in zip(rectangles, closest.tolist()):
+            closest_centers[rect.id] = centers[index].tolist()
+    return closest_centers
+
+
+def get_variant_aspect(variant: MafVariant, size: tuple[int, int]) -> float:
+    rx, ry = size
+    if variant[1]:
+        my, mx = variant[0].tiles
+    else:
+        mx, my = variant[0].tiles
+    return mx / rx + my / ry
+
+
+def turn_to_center(rect: Rect, rotation: float, center: Optional[list[float]]) -> float:
+    if center:
+        center_x, center_y = center
+        if rotation == 90 and center_x < rect.position[0]:
+            rotation = -90
+        elif rotation == 0 and center_y < rect.position[1]:
+            rotation = 180
+    return rotation
+
+
+def assign_mafs(rectangles: list[Rect], catalog: CatalogSelection, rotation_centers: list[Rect], randomize=True):
+    closest_centers = find_closest_centers(rectangles, rotation_centers)
+    to_dominant = sorted(rectangles, key=lambda rectangle: rectangle.weight)
+    budget = 0.0
+    for rect in to_dominant:
+        budget += rect.budget
+        rect.maf_budget = budget
+        variants = catalog.find_variants(budget, rect.size)
+        if variants:
+            # cheapest = variants[0]
+            # high cost =  maf, rotation = variants[-1]
+            variants = list(sorted(variants, key=lambda variant: get_variant_aspect(variant, rect.size)))
+            # best aspect ratio match
+            if randomize or rect.size[0] == rect.size[1] == 2:
+                best_variant = choice(variants[-3:])
+            else:
+                best_variant = variants[-1]
+            maf, rotated, rotation = best_variant
+            rotation = turn_to_center(rect, rotation, closest_centers.get(rect.id))
+
+            budget -= maf.cost
+            rect.maf = maf
+            rect.maf_rotation = rotation * 0.017453
+
+
+def assign_optimal(
+    rectangles: list[Rect],
+    catalog: CatalogSelection,
+    rotation_centers: list[Rect],
+    deadline: float,
+    resolution=2000
+) -> bool:
+    # multiple-choice knapsack over kind budget, maximizes spent budget plus
+    # covered tiles priced at average budget per tile, returns False when
+    # deadline is hit and nothing is assigned
+    kind_budget = float(sum(rect.budget for rect in rectangles))
+    kind_area = sum(rect.area for rect in rectangles)
+    if kind_budget <= 0 or kind_area <= 0:
+        return True
+    tile_price = kind_budget / kind_area
+    unit = max(1.0, kind_budget / resolution)
+    capacity = int(kind_budget // unit)
+
+    groups = []
+    for rect in rectangles:
+        options = {}
+        for variant in catalog.find_variants(kind_budget, rect.size):
+            maf = variant[0]
+            best = options.get(maf.key)
+            if best is None or get_variant_aspect(variant, rect.size) > get_variant_aspect(best, rect.size):
+                options[maf.key] = variant
+        if options:
+            groups.append((rect, list(options.values())))
+
+    values = np.zeros(capacity + 1)
+    choices = []
+    for rect, options in groups:
+        if time.perf_counter() > deadline:
+            return False
+        best = values.copy()
+        choice_row = np.full(capacity + 1, -1, dtype=np.int16)
+        for k, (maf, rotated, rotation) in enumerate(options):
+            weight = math.ceil(maf.cost / unit)
+            if weight > capacity:
+                continue
+            value = maf.cost + tile_price * maf.tiles[0] * maf.tiles[1]
+            candidate = values[:capacity + 1 - weight] + value
+            better = candidate > best[weight:]
+            best[weight:][better] = candidate[better]
+            choice_row[weight:][better] = k
+        values = best
+        choices.append(choice_row)
+
+    closest_centers = find_closest_centers(rectangles, rotation_centers)
+    free = capacity
+    for (rect, options), choice_row in zip(reversed(groups), reversed(choices)):
+        k = int(choice_row[free])
+        if k < 0:
+            continue
+        maf, rotated, rotation = options[k]
+        free -= math.ceil(maf.cost / unit)
+        rect.maf = maf
+        rect.maf_budget = rect.budget
+        rect.maf_rotation = turn_to_center(rect, rotation, closest_centers.get(rect.id)) * 0.017453
+    return True
@@ -0,0 +1,261 @@
+import os.path
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import is_dataclass, fields
+from threading import Lock
+from typing import Any, Callable, Optional
+
+
+def estimate_size(value: Any, seen: set = None) -> int:
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += estimate_size(key, seen) + estimate_size(item, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_size(item, seen)
+    elif is_dataclass(value):
+        for field in fields(value):
+            size += estimate_size(getattr(value, field.name), seen)
+    return size
+
+
+class SessionStore(ABC):
+    # states of shared stores are copies, they have to be put back after change
+    shared = False
+
+    @abstractmethod
+    def get(self, user: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def put(self, user: str, state: Any):
+        pass
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
+
+
+class MemorySessionStore(SessionStore):
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 24 * 60 * 60,
+        sizeof: Callable[[Any], int] = estimate_size,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.clock = clock
+        self.lock = Lock()
+        # user -> (state, size, last access), least recently used first
+        self.entries: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user: str) -> Optional[Any]:
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(user)
+            if entry is None:
+                self.misses += 1
+                return None
+            state, size, accessed = entry
+            if now - accessed > self.ttl:
+                self.remove(user)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries[user] = (state, size, now)
+            self.entries.move_to_end(user)
+            self.hits += 1
+            return state
+
+    def put(self, user: str, state: Any):
+        now = self.clock()
+        size = self.sizeof(state)
+        with self.lock:
+            if user in self.entries:
+                self.remove(user)
+            self.entries[user] = (state, size, now)
+            self.bytes += size
+            self.evict(now)
+
+    def remove(self, user: str):
+        _, size, _ = self.entries.pop(user)
+        self.bytes -= size
+
+    def evict(self, now: float):
+        # expired entries are always at the head of access order
+        while self.entries:
+            user, (_, _, accessed) = next(iter(self.entries.items()))
+            if now - accessed > self.ttl:
+                self.remove(user)
+                self.expirations += 1
+            elif len(self.entries) > self.max_entries or (self.bytes > self.max_bytes and len(self.entries) > 1):
+                self.remove(user)
+                self.evictions += 1
+            else:
+                break
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class SqliteSessionStore(SessionStore):
+    # shared by uvicorn worker processes, one WAL database file, readers never block writer
+    shared = True
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[[Any], bytes],
+        decode: Callable[[bytes], Any],
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 24 * 60 * 60,
+        clock: Callable[[], float] = time.time
+    ):
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # wall clock, it is shared by processes
+        self.clock = clock
+        # access time is written back at most that often, reads stay read-only
+        self.touch_interval = min(60.0, ttl / 10)
+        # requests wait for write lock that long, eviction gives up much sooner and is retried later
+        self.timeout = 5.0
+        self.evict_timeout = 0.05
+        # connection per thread, counters are of this process only
+        self.local = threading.local()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.skipped_evictions = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connect()
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'user TEXT PRIMARY KEY, state BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed)')
+
+    def connect(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def count(self, counter: str, amount: int = 1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, user: str) -> Optional[Any]:
+        now = self.clock()
+        connection = self.connect()
+        row = connection.execute('SELECT state, accessed FROM sessions WHERE user = ?', (user,)).fetchone()
+        if row is None:
+            self.count('misses')
+            return None
+        data, accessed = row
+        if now - accessed > self.ttl:
+            connection.execute('DELETE FROM sessions WHERE user = ? AND accessed = ?', (user, accessed))
+            self.count('expirations')
+            self.count('misses')
+            return None
+        if now - accessed > self.touch_interval:
+            connection.execute('UPDATE sessions SET accessed = ? WHERE user = ?', (now, user))
+        self.count('hits')
+        return self.decode(data)
+
+    def put(self, user: str, state: Any):
+        data = self.encode(state)
+        connection = self.connect()
+        connection.execute(
+            'INSERT INTO sessions (user, state, size, accessed) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (user) DO UPDATE SET state = excluded.state, size = excluded.size, accessed = excluded.accessed',
+            (user, data, len(data), self.clock())
+        )
+        self.count('writes')
+        # limits are enforced by every process now and then, not on each write
+        if self.writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        connection = self.connect()
+        connection.execute(f'PRAGMA busy_timeout = {int(self.evict_timeout * 1000)}')
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            # other process is writing, possibly evicting already
+            self.count('skipped_evictions')
+            return
+        finally:
+            connection.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+        with connection:
+            expired = connection.execute('DELETE FROM sessions WHERE accessed < ?', (self.clock() - self.ttl,)).rowcount
+            entries, size = connection.execute('SELECT count(*), coalesce(sum(size), 0) FROM sessions').fetchone()
+            evicted = 0
+            if entries > self.max_entries or size > self.max_bytes:
+                # least recently accessed first, running total keeps newest ones within limits
+                evicted = connection.execute(
+                    'DELETE FROM sessions WHERE user IN ('
+                    'SELECT user FROM ('
+                    'SELECT user, row_number() OVER newest AS position, sum(size) OVER newest AS total '
+                    'FROM sessions WINDOW newest AS (ORDER BY accessed DESC)'
+                    ') WHERE position > 1 AND (position > ? OR total > ?))',
+                    (self.max_entries, self.max_bytes)
+                ).rowcount
+        self.count('expirations', expired)
+        self.count('evictions', evicted)
+
+    def stats(self) -> dict:
+        entries, size = self.connect().execute('SELECT count(*), coalesce(sum(size), 0) FROM sessions').fetchone()
+        with self.lock:
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'skipped_evictions': self.skipped_evictions,
+            }
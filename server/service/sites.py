@@ -0,0 +1,140 @@
+import argparse
+import json
+import math
+import os.path
+import zipfile
+from threading import get_ident
+from typing import Iterable, Optional
+
+import numpy as np
+import shapely
+from shapely import GeometryType, STRtree
+from shapely.geometry import shape
+
+base_path = os.path.dirname(__file__)
+
+polygons_path = base_path + '/data/polygons.json'
+index_path = base_path + '/data/sites.npz'
+
+lat_meters = 110_574.0
+
+
+class SiteIndex:
+    # registry site polygons in lng/lat with STR tree over their bounds
+
+    def __init__(self, ids: np.ndarray, polygons: np.ndarray):
+        self.ids = ids
+        self.polygons = polygons
+        self.tree = STRtree(polygons)
+        self.positions = {id: position for position, id in enumerate(ids.tolist())}
+
+    @classmethod
+    def from_features(cls, features: Iterable[tuple[str, dict]]) -> 'SiteIndex':
+        ids = []
+        polygons = []
+        for id, feature in features:
+            ids.append(id)
+            polygons.append(shape(feature['geometry']))
+        return cls(np.array(ids, dtype=str), np.array(polygons, dtype=object))
+
+    @classmethod
+    def read_polygons(cls, path: str = polygons_path) -> 'SiteIndex':
+        with open(path) as polygons_file:
+            return cls.from_features(json.load(polygons_file).items())
+
+    @classmethod
+    def load(cls, path: str = index_path) -> 'SiteIndex':
+        # flat coordinates and offsets, polygons are rebuilt in one vectorized call
+        with np.load(path) as data:
+            polygons = shapely.from_ragged_array(
+                GeometryType.POLYGON,
+                data['coords'],
+                (data['ring_offsets'], data['polygon_offsets'])
+            )
+            return cls(data['ids'], polygons)
+
+    def save(self, path: str = index_path):
+        # workers of fresh deploy may build it at once, readers see whole file or none
+        _, coords, (ring_offsets, polygon_offsets) = shapely.to_ragged_array(self.polygons)
+        temp = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+        try:
+            with open(temp, 'wb') as index_file:
+                np.savez(
+                    index_file,
+                    ids=self.ids,
+                    coords=coords,
+                    ring_offsets=ring_offsets,
+                    polygon_offsets=polygon_offsets
+                )
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get_feature(self, position: int, properties: dict = None) -> dict:
+        return {
+            'type': 'Feature',
+            'id': self.ids[position].item(),
+            'properties': properties or {},
+            'geometry': self.polygons[position].__geo_interface__,
+        }
+
+    def find_in_bbox(self, west: float, south: float, east: float, north: float, limit: int) -> tuple[list[int], int]:
+        positions = self.tree.query(shapely.box(west, south, east, north), predicate='intersects')
+        positions.sort()
+        return positions[:limit].tolist(), len(positions)
+
+    def find_adjacent(self, id: str, distance: float, limit: int) -> Optional[list[tuple[int, float]]]:
+        # distance in meters, measured in local equirectangular projection of site
+        position = self.positions.get(id)
+        if position is None:
+            return None
+        site = self.polygons[position]
+        west, south, east, north = site.bounds
+        lng_meters = 111_320.0 * math.cos(math.radians(north))
+        envelope = shapely.box(
+            west - distance / lng_meters,
+            south - distance / lat_meters,
+            east + distance / lng_meters,
+            north + distance / lat_meters
+        )
+        candidates = self.tree.query(envelope, predicate='intersects')
+        candidates = candidates[candidates != position]
+        scale = np.array([lng_meters, lat_meters])
+        local = shapely.transform(self.polygons[candidates], lambda coords: coords * scale)
+        distances = shapely.distance(shapely.transform(site, lambda coords: coords * scale), local)
+        order = np.argsort(distances, kind='stable')
+        order = order[distances[order] <= distance][:limit]
+        return list(zip(candidates[order].tolist(), distances[order].tolist()))
+
+
+def load_sites(path: str = index_path, fallback: str = polygons_path) -> SiteIndex:
+    # prebuilt index is used unless polygons are newer, then it is rebuilt
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(fallback):
+        try:
+            return SiteIndex.load(path)
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as error:
+            print(f'unable to load site index {path}, rebuilding: {error}')
+    sites = SiteIndex.read_polygons(fallback)
+    try:
+        sites.save(path)
+    except OSError as error:
+        print(f'unable to save site index {path}: {error}')
+    return sites
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds binary site index from polygons.json')
+    parser.add_argument('--polygons', default=polygons_path)
+    parser.add_argument('--output', default=index_path)
+    args = parser.parse_args()
+    sites = SiteIndex.read_polygons(args.polygons)
+    sites.save(args.output)
+    print(f'indexed {len(sites)} sites to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,22 @@
 import json
+import math
 import os.path
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from typing import Optional
 
+import numpy as np
+import shapely
 from shapely import Polygon
 from shapely.geometry import shape
 from shapely.geometry.base import BaseGeometry
 from PIL import Image
 
+from service.artifacts import ArtifactCache, SiteArtifacts
+from service.caches import LruCache
+from service.catalog import Maf, CatalogStore
+from service.sessions import SessionStore, MemorySessionStore, estimate_size
+from service.sites import SiteIndex, load_sites
+
 base_path = os.path.dirname(__file__)
 
 
@@ -19,20 +28,20 @@ def as_geo(geometry: BaseGeometry) -> dict:
     return geometry.__geo_interface__
 
 
-@dataclass
-class Maf:
-    name: str
-    key: str
-    provider: str
-    number: str
-    code: str
-    category: str
-    cost: float
-    preview: str
-    model: str
-    size: list[int]
-    safe: list[int]
-    tiles: list[int]
+def as_local(geo_polygon: dict) -> list[list[float]]:
+    # exterior ring in meters from north-west corner of bounding box, x to east, y to south
+    ring = geo_polygon['coordinates'][0]
+    west = min(lng for lng, lat in ring)
+    north = max(lat for lng, lat in ring)
+    lng_meters = 111_320.0 * math.cos(math.radians(north))
+    lat_meters = 110_574.0
+    return [[(lng - west) * lng_meters, (north - lat) * lat_meters] for lng, lat in ring]
+
+
+def rasterize(area: Polygon, w: int, h: int) -> np.ndarray:
+    # tile is covered if its point (x + 0.25, y + 0.25) is inside area
+    ys, xs = np.mgrid[0:h, 0:w]
+    return shapely.contains_xy(area, xs + 0.25, ys + 0.25)
 
 
 @dataclass
@@ -45,33 +54,41 @@ class Project:
     zoom: float
     age_groups: dict[str, bool]
 
-
-def read_catalog() -> list[Maf]:
-    catalog = []
-    paths = [
-        '/data/catalog_child.json',
-        '/data/catalog_sport.json',
-        '/data/catalog_relax.json',
-    ]
-    for path in paths:
-        with open(base_path + path) as catalog_file:
-            records = json.load(catalog_file)
-            for record in records:
-                maf = Maf(**record)
-                catalog.append(maf)
-    return catalog
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'budget': self.budget,
+            'geo_polygon': self.geo_polygon,
+            'bearing': self.bearing,
+            'pitch': self.pitch,
+            'zoom': self.zoom,
+            'age_groups': self.age_groups,
+        }
 
 
 @dataclass
 class State:
     value: int
     projects: list[Project]
-    catalog: list[Maf]
+    catalog: tuple[Maf, ...]
     providers: list[str]
     last_project: Optional[str]
 
-    def as_dict(self) -> dict:
-        return asdict(self)
+    def as_dict(self, catalog: Optional[list[dict]] = None) -> dict:
+        # no deep copies, shared catalog records are embedded only on request
+        data = {
+            'value': self.value,
+            'projects': [project.as_dict() for project in self.projects],
+        }
+        if catalog is not None:
+            data['catalog'] = catalog
+        data['providers'] = self.providers
+        data['last_project'] = self.last_project
+        return data
+
+    def get_size(self) -> int:
+        # shared catalog is not accounted
+        return estimate_size([self.value, self.projects, self.providers, self.last_project])
 
     def get_project(self, name: str) -> Optional[Project]:
         for project in self.projects:
@@ -79,25 +96,126 @@ class State:
                 return project
         return None
 
+    def encode(self) -> bytes:
+        # for shared session stores, catalog is attached on load
+        return json.dumps(self.as_dict(), ensure_ascii=False, separators=(',', ':')).encode()
+
+    @staticmethod
+    def decode(data: bytes) -> 'State':
+        values = json.loads(data)
+        return State(
+            value=values['value'],
+            projects=[Project(**project) for project in values['projects']],
+            catalog=(),
+            providers=values['providers'],
+            last_project=values['last_project']
+        )
+
+
+tile_kinds = ['empty', 'sport', 'child', 'relax']
+
+pattern_offset = {
+    '000': 0,
+    '100': 32,
+    '110': 64,
+    '101': 96,
+    '001': 128,
+    '011': 160,
+    '010': 192,
+    '111': 224,
+}
+
+
+def get_pattern_key(ages: dict[str, bool]) -> str:
+    pattern_key = ''
+    pattern_key += '1' if ages['sport'] else '0'
+    pattern_key += '1' if ages['child'] else '0'
+    pattern_key += '1' if ages['relax'] else '0'
+    return pattern_key
+
+
+class PatternAtlas:
+
+    def __init__(self, kinds: np.ndarray, band_height=32):
+        # tile kind per pixel, index of tile_kinds
+        self.kinds = kinds
+        self.height, self.width = kinds.shape
+        self.band_height = band_height
+        self.bands = {
+            key: kinds[offset:offset + band_height]
+            for key, offset in pattern_offset.items()
+        }
+
+    @classmethod
+    def load(cls, path: str) -> 'PatternAtlas':
+        with Image.open(path) as image:
+            pixels = np.asarray(image.convert('RGBA'))
+        r, b = pixels[:, :, 0], pixels[:, :, 2]
+        kinds = np.full(pixels.shape[:2], 2, dtype=np.uint8)
+        kinds[r == 255] = 1
+        kinds[b == 255] = 3
+        kinds[(pixels == 255).all(axis=2)] = 0
+        return cls(kinds)
+
+    def get_grid_size(self, area: Polygon) -> tuple[int, int]:
+        ax, ay, area_w, area_h = area.bounds
+        w = max(0, min(self.width, int(area_w)))
+        h = max(0, min(self.height, int(area_h)))
+        return w, h
+
+    def rasterize(self, area: Polygon) -> np.ndarray:
+        w, h = self.get_grid_size(area)
+        return rasterize(area, w, h)
+
+    def sample(self, pattern_key: str, x: int, y: int, w: int, h: int) -> np.ndarray:
+        band = self.bands[pattern_key]
+        if x + w <= self.width and y + h <= self.band_height:
+            return band[y:y + h, x:x + w]
+        # large sites wrap around atlas
+        offset = pattern_offset[pattern_key]
+        rows = (np.arange(h) + y + offset) % self.height
+        columns = (np.arange(w) + x) % self.width
+        return self.kinds[np.ix_(rows, columns)]
+
 
 class Provider:
 
-    def __init__(self):
-        self.users = {}
-        self.patterns: Optional[Image] = None
+    def __init__(self, sessions: SessionStore = None, artifacts_path: Optional[str] = None, artifacts_max_files: int = 10_000):
+        self.sessions = sessions or MemorySessionStore(sizeof=State.get_size)
+        self.catalog = CatalogStore()
+        self.patterns = PatternAtlas.load(base_path + '/data/patterns.png')
+        self.sites = load_sites()
+        self.artifacts = ArtifactCache(self.patterns, artifacts_path, max_files=artifacts_max_files)
+        self.plans = LruCache(max_entries=256)
 
-    def get_patterns(self) -> Image:
-        if self.patterns is None:
-            self.patterns = Image.open(base_path + '/data/patterns.png')
-            self.patterns.load()
+    def get_patterns(self) -> PatternAtlas:
         return self.patterns
 
+    def get_sites(self) -> SiteIndex:
+        return self.sites
+
+    def get_artifacts(self, project: str, area: list[list[float]]) -> SiteArtifacts:
+        return self.artifacts.get(project, area)
+
+    def stats(self) -> dict:
+        return {
+            'sessions': self.sessions.stats(),
+            'artifacts': self.artifacts.stats(),
+            'plans': self.plans.stats(),
+            'catalog': {
+                'version': self.catalog.version,
+                'size': len(self.catalog.catalog),
+            },
+            'sites': len(self.sites),
+        }
+
     def get_state(self, user: str) -> State:
-        if user not in self.users:
-            providers = {}
-            self.users[user] = State(
+        catalog = self.catalog.get()
+        state = self.sessions.get(user)
+        if state is None:
+            state = State(
                 value=42,
-                catalog=read_catalog(),
+                catalog=catalog,
                 providers=['ЛЕБЕР', 'KENGURUPRO', 'АДАНАТ'],
                 last_project=None,
                 projects=[
@@ -212,13 +330,20 @@ class Provider:
                     ),
                 ]
             )
-        return self.users[user]
+            self.sessions.put(user, state)
+        state.catalog = catalog
+        return state
+
+    def save_state(self, user: str, state: State):
+        # changes of memory store states are visible at once, shared stores need them written back
+        if self.sessions.shared:
+            self.sessions.put(user, state)
 
 
 RectCoords = tuple[int, int, int, int]
 
 
-@dataclass
+@dataclass(slots=True)
 class Rect:
     id: int
     position: tuple[int, int]
@@ -235,62 +360,135 @@ class Rect:
     def area(self) -> float:
         return float(self.size[0] * self.size[1])
 
-
-def find_max_rectangles(matrix: list[list[int]], mark: int, min_area=1) -> Optional[RectCoords]:
-    position = [0, 0]
-    size = [0, 0]
-
-    if not matrix:
+    def as_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'position': self.position,
+            'size': self.size,
+            'weight': self.weight,
+            'distance': self.distance,
+            'budget': self.budget,
+            'maf_kind': self.maf_kind,
+            'maf': self.maf.as_dict() if self.maf else None,
+            'maf_budget': self.maf_budget,
+            'maf_rotation': self.maf_rotation,
+        }
+
+
+def find_max_rectangles(matrix: np.ndarray, mark: int, min_area=1) -> Optional[RectCoords]:
+    matrix = np.asarray(matrix, dtype=np.int8)
+    if matrix.ndim != 2 or matrix.size == 0:
         return None
 
-    rows = len(matrix)
-    cols = len(matrix[0])
-    left = [0] * cols  # Array to store the left boundary of consecutive 1's
-    right = [cols] * cols  # Array to store the right boundary of consecutive 1's
-    height = [0] * cols  # Array to store the height of consecutive 1's
+    rows, cols = matrix.shape
+    columns = np.arange(cols, dtype=np.int32)
+    left = np.zeros(cols, dtype=np.int32)  # Array to store the left boundary of consecutive 1's
+    right = np.full(cols, cols, dtype=np.int32)  # Array to store the right boundary of consecutive 1's
+    height = np.zeros(cols, dtype=np.int32)  # Array to store the height of consecutive 1's
 
     max_area = 0
+    found = None
 
     for i in range(0, rows):
-        row = matrix[i]
-        cur_left = 0
-        cur_right = cols
+        marked = matrix[i] == mark
 
         # Update height array
-        for j in range(0, cols):
-            if row[j] == mark:
-                height[j] += 1
-            else:
-                height[j] = 0
-
-        # Update left boundary array
-        for j in range(0, cols):
-            if row[j] == mark:
-                left[j] = max(left[j], cur_left)
-            else:
-                left[j] = 0
-                cur_left = j + 1
-
-        # Update right boundary array
-        for j in range(cols - 1, -1, -1):
-            if row[j] == mark:
-                right[j] = min(right[j], cur_right)
-            else:
-                right[j] = cols
-                cur_right = j
-
-        # Calculate maximum area for each cell
-        for j in range(0, cols):
-            area = (right[j] - left[j]) * height[j]
-            if area > max_area:
-                max_area = area
-
-                size[0] = right[j] - left[j]
-                size[1] = height[j]
-                position[0] = left[j]
-                position[1] = i - height[j] + 1
+        height = np.where(marked, height + 1, 0)
+
+        # Update left boundary array, current left is next column after closest unmarked one
+        cur_left = np.maximum.accumulate(np.where(marked, 0, columns + 1))
+        left = np.where(marked, np.maximum(left, cur_left), 0)
+
+        # Update right boundary array, current right is closest unmarked column on the right
+        cur_right = np.minimum.accumulate(np.where(marked, cols, columns)[::-1])[::-1]
+        right = np.where(marked, np.minimum(right, cur_right), cols)
+
+        # Calculate maximum area for each cell, first maximum wins
+        area = (right - left) * height
+        j = int(area.argmax())
+        if area[j] > max_area:
+            max_area = int(area[j])
+            found = (int(left[j]), i - int(height[j]) + 1, int(right[j] - left[j]), int(height[j]))
 
     if max_area > min_area:
-        return position[0], position[1], size[0], size[1]
+        return found
 
     return None
+
+
+class RectangleDecomposer:
+
+    def __init__(self, matrix: np.ndarray, mark: int):
+        self.matrix = matrix
+        self.mark = mark
+        rows, cols = matrix.shape
+        self.columns = np.arange(cols, dtype=np.int32)
+        # cached per-row histogram state, see find_max_rectangles
+        self.height = np.zeros((rows, cols), dtype=np.int32)
+        self.left = np.zeros((rows, cols), dtype=np.int32)
+        self.right = np.full((rows, cols), cols, dtype=np.int32)
+        self.row_area = np.zeros(rows, dtype=np.int64)
+        self.row_column = np.zeros(rows, dtype=np.int64)
+        self.update(0, rows)
+
+    def update(self, start: int, stop: int):
+        # rows above start are not affected, rows below stop are recomputed
+        # until their state matches the cached one
+        rows, cols = self.matrix.shape
+        if start > 0:
+            height = self.height[start - 1]
+            left = self.left[start - 1]
+            right = self.right[start - 1]
+        else:
+            height = np.zeros(cols, dtype=np.int32)
+            left = np.zeros(cols, dtype=np.int32)
+            right = np.full(cols, cols, dtype=np.int32)
+        for i in range(start, rows):
+            marked = self.matrix[i] == self.mark
+            height = np.where(marked, height + 1, 0)
+            cur_left = np.maximum.accumulate(np.where(marked, 0, self.columns + 1))
+            left = np.where(marked, np.maximum(left, cur_left), 0)
+            cur_right = np.minimum.accumulate(np.where(marked, cols, self.columns)[::-1])[::-1]
+            right = np.where(marked, np.minimum(right, cur_right), cols)
+            if i >= stop and (
+                np.array_equal(height, self.height[i]) and
+                np.array_equal(left, self.left[i]) and
+                np.array_equal(right, self.right[i])
+            ):
+                break
+            self.height[i] = height
+            self.left[i] = left
+            self.right[i] = right
+            area = (right - left) * height
+            j = int(area.argmax())
+            self.row_area[i] = area[j]
+            self.row_column[i] = j
+
+    def find(self, min_area=1) -> Optional[RectCoords]:
+        if self.row_area.size == 0:
+            return None
+        # first maximum wins, same order as full scan
+        i = int(self.row_area.argmax())
+        if self.row_area[i] > min_area:
+            j = self.row_column[i]
+            left = int(self.left[i, j])
+            height = int(self.height[i, j])
+            return left, i - height + 1, int(self.right[i, j]) - left, height
+        return None
+
+    def remove(self, rect: RectCoords):
+        sx, sy, w, h = rect
+        self.matrix[sy:sy + h, sx:sx + w] = 0
+        self.update(sy, sy + h)
+
+
+def decompose_rectangles(matrix: np.ndarray, mark: int, min_area=1) -> list[RectCoords]:
+    # found rectangles are removed from matrix, largest first
+    rectangles = []
+    if matrix.ndim != 2 or matrix.size == 0:
+        return rectangles
+    decomposer = RectangleDecomposer(matrix, mark)
+    while found := decomposer.find(min_area):
+        decomposer.remove(found)
+        rectangles.append(found)
+    return rectangles
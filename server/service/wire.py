@@ -0,0 +1,74 @@
+import base64
+import json
+
+import numpy as np
+
+from service.state import Rect
+
+# matrix cells take 2 bits (0 empty, 1 sport, 2 child, 3 relax), base64 in JSON envelope
+packed_type = 'application/vnd.add.packed+json'
+
+compact_fields = [
+    'id', 'x', 'y', 'w', 'h', 'weight', 'distance', 'budget',
+    'maf_kind', 'maf', 'maf_budget', 'maf_rotation'
+]
+
+
+def accepts_packed(headers: list[bytes]) -> bool:
+    return any(packed_type.encode() in header for header in headers)
+
+
+def pack_matrix(matrix: np.ndarray) -> str:
+    matrix = np.asarray(matrix, dtype=np.uint8)
+    if matrix.size and matrix.max() > 3:
+        raise ValueError('packed matrix cells must be in range 0..3')
+    cells = np.zeros(-(-matrix.size // 4) * 4, dtype=np.uint8)
+    cells[:matrix.size] = matrix.ravel()
+    cells = cells.reshape(-1, 4)
+    packed = cells[:, 0] << 6 | cells[:, 1] << 4 | cells[:, 2] << 2 | cells[:, 3]
+    return base64.b64encode(packed.astype(np.uint8).tobytes()).decode('ascii')
+
+
+def unpack_matrix(data: str, shape: list[int]) -> np.ndarray:
+    h, w = shape
+    packed = np.frombuffer(base64.b64decode(data), dtype=np.uint8)
+    cells = np.stack([packed >> 6, packed >> 4, packed >> 2, packed], axis=1) & 3
+    cells = cells.ravel()
+    if cells.size < h * w:
+        raise ValueError('packed matrix is shorter than its shape')
+    return cells[:h * w].reshape(h, w).astype(np.int8)
+
+
+def decode_calculation(body: bytes, content_type: bytes) -> tuple[dict, np.ndarray]:
+    # raises ValueError, KeyError or TypeError on malformed body
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise TypeError('calculation data must be an object')
+    if content_type and content_type.split(b';')[0].strip() == packed_type.encode():
+        matrix = unpack_matrix(data.pop('matrix'), data.pop('shape'))
+    else:
+        try:
+            matrix = np.array(data.pop('matrix'), dtype=np.int8)
+        except OverflowError:
+            raise ValueError('matrix cells must be in range 0..3')
+    if matrix.ndim != 2:
+        raise ValueError('matrix must be 2-dimensional')
+    if matrix.size and (matrix.min() < 0 or matrix.max() > 3):
+        raise ValueError('matrix cells must be in range 0..3')
+    return data, matrix
+
+
+def encode_compact(rects: list[Rect], catalog_version: str) -> dict:
+    # MAF referenced by key, see /api/{user}/state catalog
+    rows = []
+    for rect in rects:
+        rows.append([
+            rect.id, rect.position[0], rect.position[1], rect.size[0], rect.size[1],
+            rect.weight, rect.distance, rect.budget,
+            rect.maf_kind, rect.maf.key if rect.maf else None, rect.maf_budget, rect.maf_rotation
+        ])
+    return {
+        'catalog': catalog_version,
+        'fields': compact_fields,
+        'rects': rows,
+    }
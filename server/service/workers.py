@@ -0,0 +1,49 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+T = TypeVar('T')
+
+
+class WorkerPoolSaturated(Exception):
+
+    def __init__(self, retry_after: int):
+        super().__init__('worker pool is saturated')
+        self.retry_after = retry_after
+
+
+# runs CPU-bound work off the event loop, at most workers jobs at once
+# plus queue_depth waiting, anything above is rejected
+class WorkerPool:
+
+    def __init__(self, workers: int, queue_depth: int, retry_after: int = 1):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+        # only touched from event loop thread
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+
+    async def run(self, function: Callable[..., T], *args) -> T:
+        if self.pending >= self.workers + self.queue_depth:
+            self.rejected += 1
+            raise WorkerPoolSaturated(self.retry_after)
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(function, *args))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'pending': self.pending,
+            'rejected': self.rejected,
+            'completed': self.completed,
+        }
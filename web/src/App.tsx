@@ -1,6 +1,6 @@
 import {useCallback, useEffect, useState} from 'react'
 import './App.css'
-import {AgeGroups, getServiceState, Project, State} from "./api.ts";
+import {AgeGroups, assetPath, getServiceState, Project, State} from "./api.ts";
 import {GeoJSONSource, LngLatLike, Map} from 'mapbox-gl';
 import 'mapbox-gl/dist/mapbox-gl.css';
 import {Brash, MafInstance, View, ViewLayer} from "./view.ts";
@@ -363,7 +363,7 @@ function Constructor(props: { state: State, map: Map, view: View }) {
             <div className="catalog">
                 {state.catalog.filter(maf => providers.includes(maf.provider)).map(maf =>
                     <div key={maf.key} className="maf">
-                        <img className="preview" src={"preview/" + maf.preview} alt={maf.name}/>
+                        <img className="preview" src={assetPath("preview/" + maf.preview)} alt={maf.name}/>
                         <div className="card">
                             <div className="title">{maf.name}</div>
                             <div className="codes">{maf.provider} {maf.code} {maf.number}</div>
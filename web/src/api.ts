@@ -44,14 +44,43 @@ export interface State {
     value: number,
     projects: Project[],
     catalog: Maf[],
+    catalog_version: string,
     providers: string[]
 }
 
-export async function getServiceState(): Promise<State> {
-    const response = await fetch(`${baseUrl}/api/${user}/state`, {method: 'GET'});
+// plain asset path -> content hashed path, hashed ones are cached by browser as immutable,
+// dev server serves public folder by plain paths only
+let assetPaths: Record<string, string> = {};
+
+const assetsLoaded: Promise<void> = import.meta.env.PROD
+    ? fetch(`${baseUrl}/api/assets`)
+        .then(response => response.ok ? response.json() : {})
+        .then(paths => { assetPaths = paths; })
+        .catch(() => {})
+    : Promise.resolve();
+
+export function assetPath(path: string): string {
+    return `${baseUrl}/${assetPaths[path] ?? path}`;
+}
+
+export async function resolveAsset(path: string): Promise<string> {
+    await assetsLoaded;
+    return assetPath(path);
+}
+
+export async function getCatalog(version: string): Promise<Maf[]> {
+    // versioned catalog is immutable, it is downloaded once per catalog change
+    const response = await fetch(`${baseUrl}/api/catalog/${version}`, {method: 'GET'});
     return await response.json();
 }
 
+export async function getServiceState(): Promise<State> {
+    const response = await fetch(`${baseUrl}/api/${user}/state?catalog=0`, {method: 'GET'});
+    const state = await response.json();
+    const [catalog] = await Promise.all([getCatalog(state.catalog_version), assetsLoaded]);
+    return {...state, catalog};
+}
+
 type Tile = [[number, number], string];
 
 export async function generateProject(name: string, area: number[][], age_groups: AgeGroups): Promise<Tile[]> {
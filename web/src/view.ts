@@ -23,7 +23,7 @@ import {
     WebGLRenderer
 } from "three";
 import {Polygon, Position} from "geojson";
-import {calculateProject, generateProject, Maf, Slot} from "./api.ts";
+import {calculateProject, generateProject, Maf, resolveAsset, Slot} from "./api.ts";
 import * as turf from '@turf/turf'
 
 type ViewLoader = (scene: View) => void;
@@ -145,43 +145,43 @@ export class View {
 
     async awake() {
         // child
-        this.models['leber-lgik-120.glb'] = await this.loadModel('./models/leber-lgik-120.glb');
-        this.models['leber-lgik-803.glb'] = await this.loadModel('./models/leber-lgik-803.glb');
-        this.models['leber-msk-108101.glb'] = await this.loadModel('./models/leber-msk-108101.glb');
-        this.models['leber-lgp-97.glb'] = await this.loadModel('./models/leber-lgp-97.glb');
-        this.models['leber-lgk-31.glb'] = await this.loadModel('./models/leber-lgk-31.glb');
-        this.models['leber-msk-201.glb'] = await this.loadModel('./models/leber-msk-201.glb');
-        this.models['leber-lgp-109p.glb'] = await this.loadModel('./models/leber-lgp-109p.glb');
-        this.models['leber-lgk-109.glb'] = await this.loadModel('./models/leber-lgk-109.glb');
-        this.models['leber-lgk-20.glb'] = await this.loadModel('./models/leber-lgk-20.glb');
-        this.models['leber-lgk-247.glb'] = await this.loadModel('./models/leber-lgk-247.glb');
-        this.models['leber-lgk-21.glb'] = await this.loadModel('./models/leber-lgk-21.glb');
-        this.models['adanat-18940.glb'] = await this.loadModel('./models/adanat-18940.glb');
-        this.models['adanat-18201.glb'] = await this.loadModel('./models/adanat-18201.glb');
-        this.models['adanat-18984.glb'] = await this.loadModel('./models/adanat-18984.glb');
-        this.models['adanat-18310.glb'] = await this.loadModel('./models/adanat-18310.glb');
-        this.models['adanat-18929.glb'] = await this.loadModel('./models/adanat-18929.glb');
-        this.models['adanat-23218.glb'] = await this.loadModel('./models/adanat-23218.glb');
-        this.models['adanat-18603.glb'] = await this.loadModel('./models/adanat-18603.glb');
+        this.models['leber-lgik-120.glb'] = await this.loadModel('models/leber-lgik-120.glb');
+        this.models['leber-lgik-803.glb'] = await this.loadModel('models/leber-lgik-803.glb');
+        this.models['leber-msk-108101.glb'] = await this.loadModel('models/leber-msk-108101.glb');
+        this.models['leber-lgp-97.glb'] = await this.loadModel('models/leber-lgp-97.glb');
+        this.models['leber-lgk-31.glb'] = await this.loadModel('models/leber-lgk-31.glb');
+        this.models['leber-msk-201.glb'] = await this.loadModel('models/leber-msk-201.glb');
+        this.models['leber-lgp-109p.glb'] = await this.loadModel('models/leber-lgp-109p.glb');
+        this.models['leber-lgk-109.glb'] = await this.loadModel('models/leber-lgk-109.glb');
+        this.models['leber-lgk-20.glb'] = await this.loadModel('models/leber-lgk-20.glb');
+        this.models['leber-lgk-247.glb'] = await this.loadModel('models/leber-lgk-247.glb');
+        this.models['leber-lgk-21.glb'] = await this.loadModel('models/leber-lgk-21.glb');
+        this.models['adanat-18940.glb'] = await this.loadModel('models/adanat-18940.glb');
+        this.models['adanat-18201.glb'] = await this.loadModel('models/adanat-18201.glb');
+        this.models['adanat-18984.glb'] = await this.loadModel('models/adanat-18984.glb');
+        this.models['adanat-18310.glb'] = await this.loadModel('models/adanat-18310.glb');
+        this.models['adanat-18929.glb'] = await this.loadModel('models/adanat-18929.glb');
+        this.models['adanat-23218.glb'] = await this.loadModel('models/adanat-23218.glb');
+        this.models['adanat-18603.glb'] = await this.loadModel('models/adanat-18603.glb');
         // sport
-        this.models['kpro-018.glb'] = await this.loadModel('./models/kpro-018.glb');
-        this.models['kpro-001.glb'] = await this.loadModel('./models/kpro-001.glb');
-        this.models['kpro-010.glb'] = await this.loadModel('./models/kpro-010.glb');
-        this.models['kpro-014.glb'] = await this.loadModel('./models/kpro-014.glb');
-        this.models['kpro-022.glb'] = await this.loadModel('./models/kpro-022.glb');
-        this.models['kpro-035.glb'] = await this.loadModel('./models/kpro-035.glb');
-        this.models['kpro-023.glb'] = await this.loadModel('./models/kpro-023.glb');
-        this.models['kpro-016.glb'] = await this.loadModel('./models/kpro-016.glb');
+        this.models['kpro-018.glb'] = await this.loadModel('models/kpro-018.glb');
+        this.models['kpro-001.glb'] = await this.loadModel('models/kpro-001.glb');
+        this.models['kpro-010.glb'] = await this.loadModel('models/kpro-010.glb');
+        this.models['kpro-014.glb'] = await this.loadModel('models/kpro-014.glb');
+        this.models['kpro-022.glb'] = await this.loadModel('models/kpro-022.glb');
+        this.models['kpro-035.glb'] = await this.loadModel('models/kpro-035.glb');
+        this.models['kpro-023.glb'] = await this.loadModel('models/kpro-023.glb');
+        this.models['kpro-016.glb'] = await this.loadModel('models/kpro-016.glb');
         // relax
-        this.models['leber-lgud-18.glb'] = await this.loadModel('./models/leber-lgud-18.glb');
-        this.models['leber-lgdp-14.glb'] = await this.loadModel('./models/leber-lgdp-14.glb');
-        this.models['adanat-10045-6.glb'] = await this.loadModel('./models/adanat-10045-6.glb');
-        this.models['adanat-10008.glb'] = await this.loadModel('./models/adanat-10008.glb');
-        this.models['adanat-14014.glb'] = await this.loadModel('./models/adanat-14014.glb');
+        this.models['leber-lgud-18.glb'] = await this.loadModel('models/leber-lgud-18.glb');
+        this.models['leber-lgdp-14.glb'] = await this.loadModel('models/leber-lgdp-14.glb');
+        this.models['adanat-10045-6.glb'] = await this.loadModel('models/adanat-10045-6.glb');
+        this.models['adanat-10008.glb'] = await this.loadModel('models/adanat-10008.glb');
+        this.models['adanat-14014.glb'] = await this.loadModel('models/adanat-14014.glb');
     }
 
     async loadModel(path: string): Promise<GLTF> {
-        const model: GLTF = await this.loader.loadAsync(path);
+        const model: GLTF = await this.loader.loadAsync(await resolveAsset(path));
         model.scene.traverse(node => {
 
             if ((node as any).isMesh && !node.name.startsWith('_')) {